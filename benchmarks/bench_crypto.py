@@ -0,0 +1,57 @@
+"""
+    Signing and verification speed of the ECDSA backends (idb1.crypto) for every
+    SIGNING_ALGOS entry, on the example key and on generated P-256 and P-384 keys,
+    plus parse_many(..., verify=True) throughput.
+    Usage: PYTHONPATH=src python benchmarks/bench_crypto.py [--quick]
+"""
+import argparse
+import time
+from common import SECRET_KEY, PUBLIC_KEY, sample_visa, per_call
+from ecdsa import SigningKey, NIST256p, NIST384p
+from idb1.batch import parse_many, ItemError
+from idb1.construct_helpers import SIGNING_ALGOS
+from idb1.crypto import available_backends, load_private_key, load_public_key
+from idb1.parser import Signer
+
+def keys():
+    yield "example", SECRET_KEY, PUBLIC_KEY
+    for curve in (NIST256p, NIST384p):
+        sk = SigningKey.generate(curve=curve)
+        yield curve.name, sk.to_der(), sk.get_verifying_key().to_der()
+
+def main():
+    parser = argparse.ArgumentParser(description="ECDSA backend benchmark")
+    parser.add_argument("--quick", action="store_true", help="fewer rounds")
+    args = parser.parse_args()
+    repeat = 2 if args.quick else 5
+    backends = available_backends()
+    data = bytes(300)
+
+    print(f"{'key':<12} {'algorithm':<14} {'backend':<14} {'sign':>12} {'verify':>12} {'verify (precomputed)':>22}")
+    for key_name, sk_der, vk_der in keys():
+        for algorithm, hashfunc in SIGNING_ALGOS.items():
+            for backend in backends:
+                sk = load_private_key(sk_der, backend)
+                vk = load_public_key(vk_der, backend)
+                vk_precomputed = load_public_key(vk_der, backend, precompute=True)
+                signature = sk.sign(data, hashfunc)
+                assert vk.verify(signature, data, hashfunc)
+                sign = per_call(lambda: sk.sign(data, hashfunc), repeat=repeat)
+                verify = per_call(lambda: vk.verify(signature, data, hashfunc), repeat=repeat)
+                verify_precomputed = per_call(lambda: vk_precomputed.verify(signature, data, hashfunc), repeat=repeat)
+                print(f"{key_name:<12} {algorithm:<14} {backend:<14} {sign * 1e6:>9.1f} us {verify * 1e6:>9.1f} us "
+                      f"{verify_precomputed * 1e6:>19.1f} us")
+
+    count = 500 if args.quick else 2000
+    for backend in backends:
+        signer = Signer(SECRET_KEY, PUBLIC_KEY, backend=backend)
+        barcodes = [signer.build(sample_visa(signed=True)) for _ in range(count)]
+        vk = load_public_key(PUBLIC_KEY, backend)
+        for verify in (False, True):
+            start = time.perf_counter()
+            errors = sum(isinstance(r, ItemError) for r in parse_many(barcodes, vk=vk, verify=verify, workers=1))
+            elapsed = time.perf_counter() - start
+            print(f"parse_many(verify={verify!s:<5}) {backend:<14} {count / elapsed:>8.0f} barcodes/s  ({errors} errors)")
+
+if __name__ == "__main__":
+    main()
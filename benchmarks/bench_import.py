@@ -0,0 +1,54 @@
+"""
+    Cold import time of the library modules, each imported in a fresh interpreter,
+    and which heavy optional dependencies the import pulls in.
+    Usage: PYTHONPATH=src python benchmarks/bench_import.py [--repeat 5] [--output FILE] [MODULE ...]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ["idb1.parser", "idb1.batch", "idb1.cli", "idb1.trust", "idb1.records", "idb1.issuance", "idb1.photo", "idb1.face"]
+HEAVY = ["construct", "ecdsa", "numpy", "PIL", "cv2", "pandas", "deepface", "tensorflow", "qrcode", "streamlit"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, " ".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+def measure(module, repeat):
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+                                capture_output=True, text=True, env=os.environ)
+        if result.returncode != 0:
+            return dict(error=result.stderr.strip().splitlines()[-1])
+        elapsed, _, loaded = result.stdout.strip().partition(" ")
+        if best is None or float(elapsed) < best["ms"] / 1e3:
+            best = dict(ms=float(elapsed) * 1e3, loaded=loaded.split())
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module, the best time is kept")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    results = dict()
+    for module in args.modules:
+        r = results[module] = measure(module, args.repeat)
+        if "error" in r:
+            print(f"{module:<20} {r['error']}")
+        else:
+            print(f"{module:<20} {r['ms']:>8.1f} ms  loads: {' '.join(r['loaded']) or '-'}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+    Memory held by decoded barcodes: parse() nested dicts against parse_compact()
+    results (idb1.compact), for barcodes without photos and with photos.
+    Usage: PYTHONPATH=src python benchmarks/bench_memory.py [--count 20000]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from common import SECRET_KEY, PUBLIC_KEY, sample_visa
+from idb1.compact import parse_compact
+from idb1.parser import Signer, build, parse
+
+def barcodes(rng, count, photo_size):
+    signer = Signer(SECRET_KEY, PUBLIC_KEY)
+    out = []
+    for i in range(count):
+        obj = sample_visa(signed=(i % 2 == 0), compressed=(i % 4 < 2),
+                          photo=rng.randbytes(photo_size) if photo_size else None)
+        obj["content"]["signable"]["value"]["message"]["eu_visa"]["visa_number"] = f"{i:010d}"
+        out.append(signer.build(obj) if obj["flags"]["signed"] else build(obj))
+    return out
+
+def held(decode, inputs):
+    """ Bytes allocated by the decoded results that are still alive, and decoding time. """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = [decode(barcode) for barcode in inputs]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return size, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Decoded result memory benchmark")
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(1234)
+    decoders = [
+        ("parse()",           parse),
+        ("parse(fast=True)",  lambda barcode: parse(barcode, fast=True)),
+        ("parse_compact()",   parse_compact),
+    ]
+    for photo_size in (0, 1500):
+        inputs = barcodes(rng, args.count, photo_size)
+        print(f"{args.count} barcodes, photo {photo_size} bytes")
+        for label, decode in decoders:
+            size, elapsed = held(decode, inputs)
+            print(f"  {label:<20} {size / args.count:>8.0f} bytes/barcode  {elapsed / args.count * 1e6:>8.1f} us/barcode")
+
+if __name__ == "__main__":
+    main()
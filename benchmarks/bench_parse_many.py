@@ -0,0 +1,27 @@
+"""
+    Throughput of parse_many() for an increasing number of worker processes.
+    Usage: PYTHONPATH=src python benchmarks/bench_parse_many.py [N_BARCODES]
+"""
+import os
+import sys
+import time
+from common import build_sample
+from idb1.batch import parse_many, ItemError
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    samples = [build_sample(compressed=True), build_sample(), build_sample(signed=True), b"NDB1 not a barcode"]
+    barcodes = [samples[i % len(samples)] for i in range(count)]
+
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        errors = sum(isinstance(r, ItemError) for r in parse_many(barcodes, workers=workers))
+        elapsed = time.perf_counter() - start
+        print(f"workers={workers:<3} {count / elapsed:>10.0f} barcodes/s  ({errors} errors)")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+    Per-call cost of parse/build when the IDB1 structure is rebuilt on every call
+    (the old behaviour) versus the shared instances returned by get_idb1() and
+    get_idb1_content() (the latter is the one used by parse()).
+"""
+from common import sample_visa, build_sample, per_call, report, fresh
+import idb1.parser
+from idb1.parser import make_idb1, make_idb1_content, get_idb1, get_idb1_content, parse, build
+
+def rebuilt_schema():
+    return make_idb1()
+
+def rebuilt_content():
+    return make_idb1_content()
+
+def use(schema, content):
+    idb1.parser.get_idb1 = schema
+    idb1.parser.get_idb1_content = content
+
+def main():
+    report("make_idb1()", per_call(make_idb1))
+    report("make_idb1_content()", per_call(make_idb1_content))
+    print()
+
+    for compressed in (False, True):
+        barcode = build_sample(compressed=compressed)
+        obj = sample_visa(compressed=compressed)
+        label = "compressed" if compressed else "uncompressed"
+
+        use(rebuilt_schema, rebuilt_content)
+        try:
+            report(f"parse() rebuilding the schema [{label}]", per_call(lambda: parse(barcode)))
+            report(f"build() rebuilding the schema [{label}]", per_call(lambda: build(fresh(obj))))
+        finally:
+            use(get_idb1, get_idb1_content)
+        report(f"parse() with shared schemas [{label}]", per_call(lambda: parse(barcode)))
+        report(f"build() with shared schemas [{label}]", per_call(lambda: build(fresh(obj))))
+        print()
+
+if __name__ == "__main__":
+    main()
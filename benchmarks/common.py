@@ -0,0 +1,85 @@
+"""
+    Shared helpers for the benchmark scripts. Run them from the project root with
+    the sources on the path, e.g. `PYTHONPATH=src python benchmarks/bench_schema.py`.
+"""
+import copy
+from timeit import Timer
+
+SECRET_KEY = open("example_certs/secret.der", "rb").read()
+PUBLIC_KEY = open("example_certs/public.der", "rb").read()
+
+def date(mmddyyyy):
+    return int(mmddyyyy).to_bytes(4)
+
+def sample_visa(signed=False, compressed=False, signature_algorithm="ecdsa_sha256", photo=None):
+    return {
+        "flags": {
+            "signed":     signed,
+            "compressed": compressed,
+        },
+        "content": {
+            "signable": {
+                "value": {
+                    "header": {
+                        "country_identifier":  "ITA",
+                        "signature_algorithm": signature_algorithm if signed else None,
+                    },
+                    "message": {
+                        "eu_visa": {
+                            "issuing_member_state":     "ITA",
+                            "full_name":                "SOME PERSON",
+                            "surname_at_birth":         "PERSON",
+                            "date_of_birth":            date("01011990"),
+                            "country_of_birth":         "BRAZIL",
+                            "place_of_birth":           "RIO DE JANEIRO",
+                            "sex":                      b"M",
+                            "nationality":              "ARGENTINIAN",
+                            "nationality_at_birth":     "BRAZILIAN",
+                            "td_type":                  "PASSPORT",
+                            "td_number":                b"12AB56",
+                            "td_issuing_authority":     "SOME ISSUING AUTHORITY",
+                            "td_date": {
+                                "issue":  date("01012020"),
+                                "expiry": date("01012030")
+                            },
+                            "visa_issuing_authority":   "SOME OTHER ISSUING AUTHORITY",
+                            "visa_authority_location":  "SOME LOCATION",
+                            "visa_issued_on_behalf":    None,
+                            "visa_place_of_decision":   "SOME DECISION LOCATION",
+                            "visa_date_of_decision":    date("01012026"),
+                            "visa_type":                b"AA",
+                            "visa_limited_validity":    False,
+                            "visa_number":              "0AU3X12345",
+                            "visa_date": {
+                                "commencement": date("01012026"),
+                                "expiry":       date("06302026")
+                            },
+                            "visa_n_of_entries":        0,
+                            "visa_eueea_family_member": False,
+                            "visa_euuk_family_member":  False,
+                            "visa_comments":            "SOME COMMENT",
+                            "photo":                    photo
+                        }
+                    },
+                },
+            }
+        }
+    }
+
+def build_sample(**kwargs):
+    from idb1.parser import build
+    obj = sample_visa(**kwargs)
+    return build(obj, sk=SECRET_KEY, vk=PUBLIC_KEY) if obj["flags"]["signed"] else build(obj)
+
+def per_call(func, repeat=5, number=None):
+    """ Best per-call time in seconds over `repeat` rounds. """
+    timer = Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def report(label, seconds):
+    print(f"{label:<48} {seconds * 1e6:>12.1f} us/call")
+
+def fresh(obj):
+    return copy.deepcopy(obj)
@@ -0,0 +1,133 @@
+"""
+    Differential check of the fast path decoder (idb1.projection.parse_fast) against
+    the Construct schema, on generated barcodes and on fuzzed variants of them, and
+    timing of parse() with and without the fast path.
+    Usage: PYTHONPATH=src python benchmarks/fast_parse_diff.py [--count 2000] [--fuzz 20] [--seed 1234]
+
+    A divergence is a barcode the fast path decodes differently from the schema
+    (values, types and key order are compared) or decodes although the schema
+    rejects it; the exit status is 1 if any is found. Barcodes the fast path
+    rejects while the schema accepts them are counted as fallbacks, parse() then
+    uses the schema.
+"""
+import argparse
+import base64
+import random
+import sys
+import time
+from common import SECRET_KEY, PUBLIC_KEY, sample_visa
+from idb1.construct_helpers import SIGNING_ALGOS, decode_payload
+from idb1.parser import Signer, build, parse
+from idb1.projection import parse_fast
+
+C40_CHARS = " 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+OPTIONAL_TEXT = ("surname_at_birth", "place_of_birth", "nationality_at_birth", "visa_issued_on_behalf",
+                 "visa_place_of_decision", "visa_comments")
+MANDATORY_TEXT = ("full_name", "country_of_birth", "nationality", "td_type", "td_issuing_authority",
+                  "visa_issuing_authority", "visa_authority_location", "visa_number")
+
+def text(rng, low, high):
+    return "".join(rng.choice(C40_CHARS) for _ in range(rng.randint(low, high)))
+
+def random_visa(rng):
+    signed = rng.random() < 0.5
+    obj = sample_visa(signed=signed, compressed=rng.random() < 0.5,
+                      signature_algorithm=rng.choice(list(SIGNING_ALGOS)))
+    message = obj["content"]["signable"]["value"]["message"]
+    eu_visa = message["eu_visa"]
+    for field in MANDATORY_TEXT:
+        eu_visa[field] = text(rng, 0, 150)
+    for field in OPTIONAL_TEXT:
+        eu_visa[field] = text(rng, 0, 150) if rng.random() < 0.6 else None
+    eu_visa["visa_type"] = rng.randbytes(rng.randint(1, 4)) if rng.random() < 0.6 else None
+    eu_visa["visa_n_of_entries"] = rng.randint(0, 255) if rng.random() < 0.6 else None
+    eu_visa["visa_limited_validity"] = rng.random() < 0.5
+    eu_visa["visa_eueea_family_member"] = rng.random() < 0.5
+    eu_visa["visa_euuk_family_member"] = rng.random() < 0.5
+    eu_visa["photo"] = rng.randbytes(rng.choice((1, 100, 300, 700))) if rng.random() < 0.3 else None
+    if rng.random() < 0.2:
+        message["mrz_td1" if rng.random() < 0.5 else "mrz_td3"] = text(rng, 90, 90).replace(" ", "<")
+    if rng.random() < 0.2:
+        message["can"] = text(rng, 6, 6)
+    if rng.random() < 0.2:
+        message["photo"] = rng.randbytes(rng.randint(0, 300))
+    return obj
+
+def mutate(rng, barcode):
+    """ Mutates the decoded content and encodes it again, uncompressed, so that mutations reach the TLV layer. """
+    flags, content = decode_payload(barcode)
+    data = bytearray(content)
+    for _ in range(rng.randint(1, 3)):
+        op = rng.randrange(5)
+        pos = rng.randrange(len(data) + 1)
+        if op == 0 and pos < len(data):
+            data[pos] = rng.randrange(256)
+        elif op == 1:
+            data[pos:pos] = bytes([rng.randrange(256)])
+        elif op == 2:
+            del data[pos:pos + rng.randint(1, 4)]
+        elif op == 3:
+            del data[pos:]
+        elif pos < len(data):
+            data[pos] = rng.choice((0x00, 0x7F, 0x80, 0x81, 0x82, 0xFF))
+    return b"NDB1" + bytes([0x41 + flags["signed"]]) + base64.b32encode(bytes(data)).rstrip(b"=")
+
+def same(a, b):
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(same(a[k], b[k]) for k in a)
+    return a == b
+
+def run(barcode):
+    try:
+        return parse(barcode), None
+    except Exception as e:
+        return None, e
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast path decoder differential check")
+    parser.add_argument("--count", type=int, default=2000, help="generated barcodes")
+    parser.add_argument("--fuzz", type=int, default=20, help="fuzzed variants per generated barcode")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    signer = Signer(SECRET_KEY, PUBLIC_KEY)
+    counts = dict(equal=0, both_rejected=0, fallbacks=0, divergent=0)
+    generated = []
+    for _ in range(args.count):
+        obj = random_visa(rng)
+        try:
+            barcode = signer.build(obj) if obj["flags"]["signed"] else build(obj)
+        except Exception:
+            continue
+        generated.append(barcode)
+        for candidate in [barcode] + [mutate(rng, barcode) for _ in range(args.fuzz)]:
+            expected, error = run(candidate)
+            try:
+                got = parse_fast(candidate)
+            except Exception:
+                counts["both_rejected" if error is not None else "fallbacks"] += 1
+                continue
+            if error is None and same(got, expected):
+                counts["equal"] += 1
+            else:
+                counts["divergent"] += 1
+                print(f"divergence: {candidate.decode()}", file=sys.stderr)
+                print(f"  schema: {error!r}" if error is not None else f"  schema: {expected}", file=sys.stderr)
+                print(f"  fast:   {got}", file=sys.stderr)
+
+    print(f"{len(generated)} generated barcodes, {args.fuzz} fuzzed variants each")
+    print("  ".join(f"{k}={v}" for k, v in counts.items()))
+
+    for fast in (False, True):
+        start = time.perf_counter()
+        for barcode in generated:
+            parse(barcode, fast=fast)
+        elapsed = time.perf_counter() - start
+        print(f"parse(fast={fast}): {elapsed / len(generated) * 1e6:>8.1f} us/barcode")
+    return 1 if counts["divergent"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
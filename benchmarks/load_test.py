@@ -0,0 +1,100 @@
+"""
+    Load test of the decoding service (idb1.server): throughput and latency
+    percentiles for concurrent pipelining clients.
+    Usage: PYTHONPATH=src python benchmarks/load_test.py [--spawn | --host H --port P]
+                                                         [--requests 5000] [--connections 16] [--depth 8]
+
+    With --spawn a server is started on a free local port with the example
+    certificate (extra server options follow `--`, e.g. `-- --processes`). Every
+    client keeps up to --depth requests in flight on its connection; latency is
+    measured from sending a line to reading its response.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from common import build_sample
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawn(port, extra):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, ["src", os.environ.get("PYTHONPATH")])))
+    process = subprocess.Popen([sys.executable, "-m", "idb1.server", "--port", str(port),
+                                "--public", "example_certs/public.der", *extra],
+                               env=env, stderr=subprocess.PIPE, text=True)
+    line = process.stderr.readline()
+    if "listening" not in line:
+        process.kill()
+        raise Exception(f"Server did not start: {line.strip() or process.stderr.read().strip()}")
+    return process
+
+async def client(host, port, barcodes, depth, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    sent = asyncio.Queue(depth)
+
+    async def send():
+        for barcode in barcodes:
+            await sent.put(time.perf_counter())
+            writer.write(barcode + b"\n")
+            await writer.drain()
+
+    sender = asyncio.create_task(send())
+    for _ in barcodes:
+        line = await reader.readline()
+        latencies.append(time.perf_counter() - sent.get_nowait())
+        if line.startswith(b'{"error"'):
+            errors.append(line)
+    await sender
+    writer.close()
+    await writer.wait_closed()
+
+async def run(host, port, barcodes, connections, depth):
+    latencies, errors = [], []
+    share = [barcodes[i::connections] for i in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, part, depth, latencies, errors) for part in share if part))
+    return time.perf_counter() - start, latencies, errors
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Decoding service load test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--spawn", action="store_true", help="start a local server for the test")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--depth", type=int, default=8, help="requests in flight per connection")
+    parser.add_argument("server_args", nargs="*", help="extra idb1.server options with --spawn")
+    args = parser.parse_args()
+
+    samples = [build_sample(signed=True), build_sample(signed=True, compressed=True), build_sample(compressed=True)]
+    barcodes = [samples[i % len(samples)] for i in range(args.requests)]
+
+    process = None
+    if args.spawn:
+        args.host, args.port = "127.0.0.1", free_port()
+        process = spawn(args.port, args.server_args)
+    try:
+        elapsed, latencies, errors = asyncio.run(run(args.host, args.port, barcodes, args.connections, args.depth))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies.sort()
+    print(f"{len(latencies)} requests, {args.connections} connections, depth {args.depth}: "
+          f"{len(latencies) / elapsed:.0f} requests/s ({len(errors)} errors)")
+    print("latency ms: " + "  ".join(f"{label}={percentile(latencies, p) * 1e3:.1f}"
+                                     for label, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
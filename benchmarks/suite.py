@@ -0,0 +1,170 @@
+"""
+    Benchmark suite for the parse/build hot path across the flag matrix (signed and
+    compressed, every signature algorithm), text lengths and photo sizes, plus the
+    building blocks (C40, DerLengthInt, Base32, signature verification). Payloads are
+    generated from a fixed seed so runs are comparable.
+
+    Usage: PYTHONPATH=src python benchmarks/suite.py [--quick] [--output FILE]
+                                                     [--compare BASELINE] [--threshold 0.1]
+
+    Results are written as JSON (ops/sec, p50 and p99 latency per case). With
+    --compare, cases whose p50 latency grew by more than the threshold are reported
+    as regressions and the exit status is 1.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from importlib.metadata import version
+from common import SECRET_KEY, PUBLIC_KEY, sample_visa, fresh
+from construct import GreedyBytes
+from idb1.construct_helpers import SIGNING_ALGOS, C40, DerLengthInt, Base32, c40_decode_many, c40_encode_many
+from idb1.crypto import get_backend
+from idb1.parser import parse, verify, Signer
+
+C40_CHARS = " 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+TEXT_FIELDS = ("full_name", "surname_at_birth", "country_of_birth", "place_of_birth", "nationality",
+               "nationality_at_birth", "td_type", "td_issuing_authority", "visa_issuing_authority",
+               "visa_authority_location", "visa_place_of_decision", "visa_comments")
+
+def synthetic_visa(rng, signed, compressed, signature_algorithm, text_length, photo_size):
+    obj = sample_visa(signed=signed, compressed=compressed, signature_algorithm=signature_algorithm,
+                      photo=rng.randbytes(photo_size) if photo_size else None)
+    eu_visa = obj["content"]["signable"]["value"]["message"]["eu_visa"]
+    for field in TEXT_FIELDS:
+        eu_visa[field] = "".join(rng.choice(C40_CHARS) for _ in range(text_length)).strip() or "X"
+    return obj
+
+def measure(func, iterations):
+    for _ in range(max(iterations // 10, 1)):
+        func()
+    samples = []
+    clock = time.perf_counter_ns
+    for _ in range(iterations):
+        start = clock()
+        func()
+        samples.append(clock() - start)
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": iterations / (sum(samples) / 1e9),
+        "p50_us": samples[len(samples) // 2] / 1e3,
+        "p99_us": samples[min(int(len(samples) * 0.99), len(samples) - 1)] / 1e3,
+    }
+
+def cases(rng, quick):
+    signer = Signer(SECRET_KEY, PUBLIC_KEY)
+    text_lengths = (8, 64)
+    photo_sizes = (0, 2048) if quick else (0, 1024, 8192)
+
+    for signed in (False, True):
+        for compressed in (False, True):
+            for algorithm in (SIGNING_ALGOS if signed else [None]):
+                for text_length in text_lengths:
+                    for photo_size in photo_sizes:
+                        obj = synthetic_visa(rng, signed, compressed, algorithm, text_length, photo_size)
+                        barcode = signer.build(fresh(obj))
+                        label = (f"signed={int(signed)},compressed={int(compressed)},algo={algorithm or '-'},"
+                                 f"text={text_length},photo={photo_size}")
+                        yield f"parse[{label}]", lambda barcode=barcode: parse(barcode)
+                        yield f"build[{label}]", lambda obj=obj: signer.build(fresh(obj))
+                        if signed and text_length == text_lengths[0] and photo_size == 0:
+                            parsed = parse(barcode)
+                            yield f"verify[{label}]", lambda parsed=parsed: verify(parsed, PUBLIC_KEY)
+
+    c40 = C40(GreedyBytes)
+    for length in (12, 120, 1200):
+        text = "".join(rng.choice(C40_CHARS) for _ in range(length))
+        encoded = c40.build(text)
+        yield f"c40_encode[{length}]", lambda text=text: c40.build(text)
+        yield f"c40_decode[{length}]", lambda encoded=encoded: c40.parse(encoded)
+
+    texts = ["".join(rng.choice(C40_CHARS) for _ in range(rng.randint(4, 40))) for _ in range(1000)]
+    encoded_texts = c40_encode_many(texts)
+    yield "c40_encode_many[1000]", lambda: c40_encode_many(texts)
+    yield "c40_decode_many[1000]", lambda: c40_decode_many(encoded_texts)
+
+    for value in (5, 200, 70000):
+        encoded = DerLengthInt.build(value)
+        yield f"der_length_build[{value}]", lambda value=value: DerLengthInt.build(value)
+        yield f"der_length_parse[{value}]", lambda encoded=encoded: DerLengthInt.parse(encoded)
+
+    base32 = Base32(GreedyBytes)
+    for size in (100, 1000, 10000):
+        data = rng.randbytes(size)
+        encoded = base32.build(data)
+        yield f"base32_encode[{size}]", lambda data=data: base32.build(data)
+        yield f"base32_decode[{size}]", lambda encoded=encoded: base32.parse(encoded)
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        ratio = result["p50_us"] / old["p50_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<80} {old['p50_us']:>10.1f} -> {result['p50_us']:>10.1f} us  ({ratio:>5.2f}x){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="IDB1 benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="fewer cases and iterations")
+    parser.add_argument("--iterations", type=int, help="iterations per case (default: 200, 50 with --quick)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this string")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="p50 slowdown reported as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    iterations = args.iterations or (50 if args.quick else 200)
+    rng = random.Random(args.seed)
+    results = dict()
+    for name, func in cases(rng, args.quick):
+        if args.filter not in name:
+            continue
+        # Heavier cases (signing, verification) get fewer iterations
+        n = iterations // 4 if name.startswith(("verify", "build[signed=1")) else iterations
+        results[name] = measure(func, max(n, 5))
+        r = results[name]
+        print(f"{name:<80} {r['ops_per_sec']:>10.0f} ops/s  p50 {r['p50_us']:>9.1f} us  p99 {r['p99_us']:>9.1f} us")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "construct": version("construct"),
+            "ecdsa": version("ecdsa"),
+            "crypto_backend": get_backend().name,
+            "crypto_backend_version": version(get_backend().name),
+            "seed": args.seed,
+            "iterations": iterations,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        baseline_backend = baseline.get("meta", {}).get("crypto_backend")
+        if baseline_backend and baseline_backend != report["meta"]["crypto_backend"]:
+            print(f"Note: the baseline was measured with the {baseline_backend} crypto backend")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
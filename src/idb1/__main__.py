@@ -0,0 +1,4 @@
+import sys
+from idb1.cli import main
+
+sys.exit(main())
@@ -0,0 +1,116 @@
+import os
+from collections import deque, namedtuple
+from itertools import islice
+from idb1.construct_helpers import SIGNING_ALGOS
+from idb1.parser import get_idb1_content, parse, _public_key
+
+# Failure of a single item in a batch: position in the input, exception class name
+# and message. Returned in place of the result so that one bad barcode does not
+# abort the whole batch.
+ItemError = namedtuple("ItemError", ["index", "error", "message"])
+
+def _chunks(iterable, chunksize):
+    it = iter(iterable)
+    start = 0
+    while chunk := list(islice(it, chunksize)):
+        yield start, chunk
+        start += len(chunk)
+
+def map_chunks(func, iterable, workers=None, chunksize=256, initializer=None, initargs=(), args=()):
+    """
+        Calls `func(start, chunk, *args)` on consecutive chunks of `iterable` and yields
+        the items of the returned lists in input order. With more than one worker the
+        chunks run on a process pool; at most two chunks per worker are in flight, so
+        the input is consumed lazily and memory stays bounded whatever its length.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for start, chunk in _chunks(iterable, chunksize):
+            yield from func(start, chunk, *args)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        for start, chunk in _chunks(iterable, chunksize):
+            pending.append(executor.submit(func, start, chunk, *args))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def _init_parser():
+    # Build the schema used by parse() before the first chunk arrives
+    get_idb1_content()
+
+def _parse_chunk(start, barcodes, vk, verify=False):
+    results = []
+    if vk is not None:
+        # Load the key once per chunk rather than once per barcode
+        try:
+            vk = _public_key(vk)
+        except Exception as e:
+            return [ItemError(index, type(e).__name__, str(e)) for index in range(start, start + len(barcodes))]
+    for index, barcode in enumerate(barcodes, start):
+        try:
+            results.append(parse(barcode, vk=vk, verify=verify))
+        except Exception as e:
+            results.append(ItemError(index, type(e).__name__, str(e)))
+    return results
+
+def parse_many(barcodes, vk=None, workers=None, chunksize=256, verify=False):
+    """
+        Parses an iterable of barcodes, yielding results in input order. Items that
+        fail to parse yield an ItemError instead of raising. `workers` defaults to the
+        number of CPUs, use 1 to parse in the calling process. With `verify`, 
+        signatures are checked against `vk` on the workers, and unsigned barcodes or 
+        invalid signatures yield an ItemError (see parse()).
+    """
+    return map_chunks(_parse_chunk, barcodes, workers=workers, chunksize=chunksize,
+                      initializer=_init_parser, args=(vk, verify))
+
+def _verify_chunk(start, items, vk):
+    results = []
+    for index, item in enumerate(items, start):
+        if isinstance(item, ItemError):
+            results.append(item)
+            continue
+        signature, digest, hashfunc = item
+        if signature is None:
+            results.append(ItemError(index, "Exception", "The barcode is not signed"))
+            continue
+        try:
+            results.append(vk.verify_digest(signature, digest, hashfunc))
+        except Exception as e:
+            results.append(ItemError(index, type(e).__name__, str(e)))
+    return results
+
+def _signed_digests(parsed_items):
+    # ItemErrors (e.g. from parse_many) are passed through, other bad items become one
+    for index, parsed in enumerate(parsed_items):
+        if isinstance(parsed, ItemError):
+            yield parsed
+            continue
+        try:
+            content = parsed["content"]
+            if "signature_data" not in content:
+                yield None, None, None
+                continue
+            hashfunc = SIGNING_ALGOS[content["signable"]["header"]["signature_algorithm"]]
+            yield content["signature_data"], hashfunc(content["signable"]["raw_data"]).digest(), hashfunc
+        except Exception as e:
+            yield ItemError(index, type(e).__name__, str(e))
+
+def verify_many(parsed_items, vk, workers=None, chunksize=256):
+    """
+        Verifies the signatures of an iterable of parse() results against one public
+        key, yielding True or False in input order (an ItemError for unsigned
+        barcodes or invalid items). ItemErrors in the input, such as those yielded by
+        parse_many(), are yielded unchanged. Each raw_data is hashed once in the calling process, only the
+        signatures and digests are sent to the workers.
+    """
+    return map_chunks(_verify_chunk, _signed_digests(parsed_items), workers=workers, chunksize=chunksize,
+                      args=(_public_key(vk),))
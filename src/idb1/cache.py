@@ -0,0 +1,138 @@
+"""
+    Opt-in cache of decoding results, for scanners that read the same barcode
+    several times within seconds (retries, several cameras, a document presented
+    again). Results are kept in a thread-safe LRU with a time to live, bounded both
+    in entries and in (estimated) bytes, and keyed by a digest of the barcode, the
+    fingerprint of the verifying key and the parse() options:
+
+        cache = ParseCache(max_entries=4096, max_bytes=32 * 1024 * 1024, ttl=60)
+        parsed = cache.parse(barcode, vk=public_key_der, verify=True)
+        cache.stats()   # CacheStats(hits=..., misses=..., evictions=..., expirations=..., entries=..., bytes=...)
+
+    Every call returns a fresh copy of the cached dicts, so callers may modify
+    them. Memoryviews (the photos of projections) are copied to bytes when cached,
+    so that entries do not keep whole decoded payloads alive and their size is
+    known. Failures (exceptions raised while computing a value) are not cached.
+    Concurrent misses for the same barcode are decoded by each caller.
+"""
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from hashlib import sha256
+from threading import Lock
+from idb1.construct_helpers import MAX_INFLATED_SIZE
+from idb1.parser import parse
+
+CacheStats = namedtuple("CacheStats", ["hits", "misses", "evictions", "expirations", "entries", "bytes"])
+
+def barcode_digest(barcode):
+    """ Cache key part for the raw bytes of a barcode. """
+    return sha256(barcode).digest()
+
+def key_fingerprint(vk):
+    """ SHA-256 of the DER form of a public key (DER bytes, idb1.crypto.PublicKey or ecdsa VerifyingKey). """
+    if vk is None:
+        return None
+    if isinstance(vk, (bytes, bytearray, memoryview)):
+        return sha256(vk).digest()
+    from idb1.crypto import as_public_key
+    return sha256(as_public_key(vk).der).digest()
+
+def _copy(obj):
+    if isinstance(obj, dict):
+        return { k: _copy(v) for k, v in obj.items() }
+    return obj
+
+def _detach(obj):
+    # Copies memoryviews, which would otherwise keep their whole buffer alive
+    if isinstance(obj, dict):
+        return { k: _detach(v) for k, v in obj.items() }
+    if isinstance(obj, memoryview):
+        return obj.tobytes()
+    return obj
+
+def _size(obj):
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_size(v) for v in obj.values())
+    return sys.getsizeof(obj)
+
+class ParseCache:
+    """ LRU of decoding results, see above; `ttl` is in seconds of `clock`. """
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=60.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._init()
+
+    def _init(self):
+        # key: (expiry time, size, value)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def lookup(self, key, compute):
+        """
+            Returns a copy of the value cached for `key` (a hashable, e.g. built from
+            barcode_digest()), or of compute() which is then cached.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return _copy(entry[2])
+                self._remove(key)
+                self._expirations += 1
+            self._misses += 1
+
+        value = _detach(compute())
+        size = _size(value) + sys.getsizeof(key)
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (now + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+        return _copy(value)
+
+    def parse(self, barcode, vk=None, fields=None, max_inflated_size=MAX_INFLATED_SIZE, fast=False, verify=False):
+        """ Same as parse(), through the cache. """
+        key = (barcode_digest(barcode), key_fingerprint(vk), tuple(fields) if fields is not None else None,
+               max_inflated_size, verify)
+        return self.lookup(key, lambda: parse(barcode, vk=vk, fields=fields, max_inflated_size=max_inflated_size,
+                                              fast=fast, verify=verify))
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._expirations,
+                              len(self._entries), self._bytes)
+
+    def clear(self):
+        """ Drops every entry, statistics are kept. """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # Only the settings are pickled, worker processes start with an empty cache
+        return dict(max_entries=self.max_entries, max_bytes=self.max_bytes, ttl=self.ttl, clock=self.clock)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init()
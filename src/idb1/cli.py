@@ -0,0 +1,120 @@
+"""
+    Command line interface, streams line-delimited input to stdout:
+
+        idb1 [--secret FILE] [--public FILE] [--trust-dir DIR] [--include-cert] [--verify] [--workers N] <enc|dec> [FILE ...]
+
+    `dec` reads one barcode per line and writes one JSON record per line (see
+    idb1.records), `enc` reads one JSON record per line and writes one barcode per line.
+    Input is read from the given files, or from stdin if none is given.
+"""
+import argparse
+import json
+import sys
+from idb1.batch import map_chunks, ItemError
+from idb1.parser import parse, build, Signer
+from idb1.records import to_record, from_record
+
+_trust_store = None
+_signer = None
+
+def _init_decoder(trust_store):
+    global _trust_store
+    _trust_store = trust_store
+
+def _init_encoder(signer):
+    global _signer
+    _signer = signer
+
+def _read_lines(files, binary):
+    if not files:
+        files = ["-"]
+    for name in files:
+        if name == "-":
+            f = sys.stdin.buffer if binary else sys.stdin
+            yield from f
+        else:
+            with open(name, "rb" if binary else "r") as f:
+                yield from f
+
+def _decode_chunk(start, lines, check_signature):
+    results = []
+    for index, line in enumerate(lines, start):
+        try:
+            parsed = parse(line.strip())
+            record = to_record(parsed)
+            if check_signature:
+                record["signature"] = _trust_store.signature_status(parsed)
+            results.append(record)
+        except Exception as e:
+            results.append(ItemError(index, type(e).__name__, str(e)))
+    return results
+
+def _encode_chunk(start, lines):
+    results = []
+    for index, line in enumerate(lines, start):
+        try:
+            obj = from_record(json.loads(line))
+            results.append(_signer.build(obj) if _signer is not None else build(obj))
+        except Exception as e:
+            results.append(ItemError(index, type(e).__name__, str(e)))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="idb1", description="Encoder/Decoder for ICAO Datastructure for Barcode.")
+    parser.add_argument("--secret", type=argparse.FileType("rb"), help="ECDSA signing key (DER), required to encode signed barcodes")
+    parser.add_argument("--public", type=argparse.FileType("rb"), help="public signer certificate (DER)")
+    parser.add_argument("--trust-dir", help="directory of trusted signer certificates (*.der) used by --verify")
+    parser.add_argument("--include-cert", action="store_true", help="embed the signer certificate in signed barcodes")
+    parser.add_argument("--verify", action="store_true", help="verify signatures against --public and --trust-dir when decoding")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--chunksize", type=int, default=256, help="lines handed to a worker at a time (default: 256)")
+    parser.add_argument("command", choices=["enc", "dec"])
+    parser.add_argument("files", nargs="*", metavar="FILE", help="input files (default: stdin)")
+    args = parser.parse_args(argv)
+
+    sk = args.secret.read() if args.secret else None
+    vk = args.public.read() if args.public else None
+    signer = None
+    if args.command == "enc" and sk is not None:
+        try:
+            signer = Signer(sk, vk, include_cert=args.include_cert)
+        except Exception as e:
+            parser.error(str(e))
+
+    trust_store = None
+    if args.verify:
+        from idb1.trust import TrustStore
+        if vk is None and args.trust_dir is None:
+            parser.error("--verify requires --public or --trust-dir")
+        try:
+            trust_store = TrustStore.from_directory(args.trust_dir) if args.trust_dir else TrustStore()
+            if vk is not None:
+                trust_store.add(vk)
+        except Exception as e:
+            parser.error(str(e))
+
+    lines = (line for line in _read_lines(args.files, binary=(args.command == "dec")) if line.strip())
+    if args.command == "dec":
+        results = map_chunks(_decode_chunk, lines, workers=args.workers, chunksize=args.chunksize,
+                             initializer=_init_decoder, initargs=(trust_store,), args=(args.verify,))
+    else:
+        results = map_chunks(_encode_chunk, lines, workers=args.workers, chunksize=args.chunksize,
+                             initializer=_init_encoder, initargs=(signer,))
+
+    failed = False
+    out = sys.stdout
+    for result in results:
+        if isinstance(result, ItemError):
+            failed = True
+            print(f"idb1: record {result.index + 1}: {result.message}", file=sys.stderr)
+            out.write(json.dumps({"error": result.error, "message": result.message}) if args.command == "dec" else "")
+        elif args.command == "dec":
+            out.write(json.dumps(result))
+        else:
+            out.write(result.decode())
+        out.write("\n")
+    out.flush()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+    Compact decoding results, for holding many decoded barcodes in memory (e.g. for
+    deduplication and matching). parse_compact() returns a Visa of nested
+    namedtuples instead of nested dicts:
+
+        Visa(signed, compressed, header, message, signer_certificate, signature_data, content, message_end)
+        Header(country_identifier, signature_algorithm, certificate_reference, signature_creation_date)
+        Message(mrz_td1, mrz_td3, can, photo, eu_visa)
+        EuVisa(issuing_member_state, full_name, ..., td_date=DatePair, visa_date=DatePair, ...)
+
+    Absent fields are None. The decoded content is kept once: raw_data is a
+    memoryview into it computed on access, and photos are memoryviews into it
+    rather than copies. Dates and the short, repetitive text fields are interned.
+    Results are immutable and hashable, so they can be put in sets or used as keys.
+    to_dict() returns exactly the output of parse().
+"""
+import sys
+from collections import namedtuple
+from idb1.construct_helpers import MAX_INFLATED_SIZE, decode_payload
+from idb1.projection import ALL_FIELDS, EU_VISA_FIELDS, der_length, _view, _walk
+
+# Text fields whose values repeat across barcodes
+INTERNED_FIELDS = ("issuing_member_state", "date_of_birth", "country_of_birth", "nationality",
+                   "nationality_at_birth", "td_type", "td_issuing_authority", "visa_issuing_authority",
+                   "visa_authority_location", "visa_issued_on_behalf", "visa_place_of_decision",
+                   "visa_date_of_decision")
+
+Header = namedtuple("Header", ["country_identifier", "signature_algorithm", "certificate_reference",
+                               "signature_creation_date"], defaults=(None, None, None))
+Message = namedtuple("Message", ["mrz_td1", "mrz_td3", "can", "photo", "eu_visa"], defaults=(None,) * 5)
+EuVisa = namedtuple("EuVisa", EU_VISA_FIELDS, defaults=(None,) * len(EU_VISA_FIELDS))
+TdDate = namedtuple("TdDate", ["issue", "expiry"])
+VisaDate = namedtuple("VisaDate", ["commencement", "expiry"])
+
+class Visa(namedtuple("Visa", ["signed", "compressed", "header", "message", "signer_certificate",
+                               "signature_data", "content", "message_end"])):
+    __slots__ = ()
+
+    @property
+    def raw_data(self):
+        """ The signed bytes (header and message), as a view into the content. """
+        return memoryview(self.content)[:self.message_end]
+
+    def to_dict(self):
+        return to_dict(self)
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
+
+def _pair(cls, value):
+    return cls(*(sys.intern(v) for v in value.values())) if value is not None else None
+
+def _compact(flags, parsed, content, message_end):
+    signable = parsed["content"]["signable"]
+    header = signable["header"]
+    message = signable["message"]
+    eu_visa = message.get("eu_visa")
+    if eu_visa is not None:
+        values = dict(eu_visa)
+        for field in INTERNED_FIELDS:
+            if field in values:
+                values[field] = sys.intern(values[field])
+        values["td_date"] = _pair(TdDate, values.get("td_date"))
+        values["visa_date"] = _pair(VisaDate, values.get("visa_date"))
+        eu_visa = EuVisa(**values)
+
+    return Visa(flags["signed"], flags["compressed"],
+                Header(sys.intern(header["country_identifier"]), header.get("signature_algorithm"),
+                       header.get("certificate_reference"), _intern(header.get("signature_creation_date"))),
+                Message(message.get("mrz_td1"), message.get("mrz_td3"), message.get("can"),
+                        message.get("photo"), eu_visa),
+                parsed["content"].get("signer_certificate"), parsed["content"].get("signature_data"),
+                content, message_end)
+
+def _message_end(flags, content):
+    pos = 12 if flags["signed"] else 2
+    length, pos = der_length(content, pos + 1)
+    return pos + length
+
+def parse_compact(barcode, max_inflated_size=MAX_INFLATED_SIZE):
+    """ Decodes a barcode into a Visa, with the fast path and the Construct schema as fallback. """
+    try:
+        flags, content = decode_payload(barcode, max_inflated_size)
+        parsed = _walk(flags, content, [field for field in ALL_FIELDS if field != "raw_data"], EU_VISA_FIELDS, _view)
+        return _compact(flags, parsed, content, _message_end(flags, content))
+    except Exception:
+        # The schema is the reference, let it report the error
+        from idb1.parser import parse
+        parsed = parse(barcode, max_inflated_size=max_inflated_size)
+        raw_data = parsed["content"]["signable"]["raw_data"]
+        return _compact(dict(signed=False, compressed=False) | parsed["flags"], parsed, raw_data, len(raw_data))
+
+def _fields(record):
+    out = dict()
+    for k, v in zip(record._fields, record):
+        if v is None or v is False:
+            continue
+        if isinstance(v, tuple):
+            v = _fields(v)
+        elif isinstance(v, memoryview):
+            v = bytes(v)
+        out[k] = v
+    return out
+
+def to_dict(visa):
+    """ Returns the parse() output for a Visa. """
+    signable = dict(header=_fields(visa.header), message=_fields(visa.message), raw_data=bytes(visa.raw_data))
+    content = dict(signable=signable)
+    if visa.signer_certificate is not None:
+        content["signer_certificate"] = visa.signer_certificate
+    if visa.signature_data is not None:
+        content["signature_data"] = visa.signature_data
+    flags = { k: True for k in ("signed", "compressed") if getattr(visa, k) }
+    return dict(flags=flags, content=content)
@@ -1,6 +1,10 @@
-import base64
+import binascii
+import struct
+import zlib
+from functools import lru_cache
 from hashlib import sha256, sha384, sha512
 from construct import *
+from idb1 import instrumentation
 
 SIGNING_ALGOS = dict(ecdsa_sha256=sha256, ecdsa_sha384=sha384, ecdsa_sha512=sha512)
 
@@ -33,32 +37,330 @@ class DerLengthInt(Construct):
         return obj
 
 class Signature(Construct):
-    def __init__(self, sigfield, bytesfunc, vk=None, sk=None):
+    """
+        The signing key is not stored in the construct, it is expected as a build
+        parameter instead, together with the hash function (e.g. 
+        `struct.build(obj, sk=sk, hashfunc=sha256)`), so that a single structure can 
+        be shared by every build.
+    """
+    def __init__(self, sigfield, bytesfunc):
         super().__init__()
         self.sigfield = sigfield
         self.bytesfunc = bytesfunc
-        self.vk = vk
-        self.sk = sk
 
     def _parse(self, stream, context, path):
         sig = self.sigfield._parsereport(stream, context, path)
         return sig
 
     def _build(self, obj, stream, context, path):
-        sig = self.sk.sign(self.bytesfunc(context))
+        if instrumentation.enabled:
+            sig = instrumentation.timed("ecdsa_sign", context._params.sk.sign, self.bytesfunc(context), hashfunc=context._params.hashfunc)
+        else:
+            sig = context._params.sk.sign(self.bytesfunc(context), hashfunc=context._params.hashfunc)
         self.sigfield._build(sig, stream, context, path)
         return sig
 
     def _sizeof(self, context, path):
         return self.sigfield._sizeof(context, path)
 
+# Upper bound for the inflated content of compressed barcodes, anything larger is 
+# rejected while inflating.
+MAX_INFLATED_SIZE = 64 * 1024
+
+# Maps the Base32 alphabet to the digits accepted by int(x, 32), anything else to a 
+# character int() rejects.
+_B32_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+_B32_DIGITS = bytes(b"0123456789abcdefghijklmnopqrstuv"[_B32_ALPHABET.index(c)] if c in _B32_ALPHABET else ord("!")
+                    for c in range(256))
+
+def b32decode_unpadded(data):
+    """
+        Base32 decoding of unpadded (or padded) data, equivalent to base64.b32decode on
+        the padded input but without building the padded copy: the digits are 
+        converted to a single integer in one go.
+    """
+    stripped = data.rstrip(b"=")
+    padchars = len(data) + (-len(data) % 8) - len(stripped)
+    if padchars not in {0, 1, 3, 4, 6}:
+        raise binascii.Error("Incorrect padding")
+    if not stripped:
+        return b""
+    try:
+        value = int(stripped.translate(_B32_DIGITS), 32)
+    except ValueError:
+        raise binascii.Error("Non-base32 digit found") from None
+    bits = 5 * len(stripped)
+    return (value >> (bits % 8)).to_bytes(bits // 8, "big")
+
+_B32_ENCODE = bytes.maketrans(bytes(range(32)), _B32_ALPHABET)
+
+@lru_cache(maxsize=32)
+def _b32_spread_masks(groups):
+    """ Masks selecting the lower half of every block of 2s groups once spread to bytes, for s = groups/2 .. 1. """
+    masks = []
+    s = groups // 2
+    while s >= 1:
+        masks.append((s, int.from_bytes(((1 << (5 * s)) - 1).to_bytes(2 * s, "little") * (groups // (2 * s)), "little")))
+        s //= 2
+    return masks
+
+def b32encode_unpadded(data):
+    """
+        Base32 encoding without padding, equivalent to base64.b32encode(data).rstrip(b"=").
+        The data is read as a single integer whose 5 bit groups are spread to one byte
+        each by halving shifts (log2 of the length big integer operations instead of
+        a Python step per 5 bytes), then mapped to the alphabet with translate().
+    """
+    if not data:
+        return b""
+    pad = -len(data) % 5
+    groups = (len(data) + pad) * 8 // 5
+    value = int.from_bytes(data, "big") << (8 * pad)
+    for s, low in _b32_spread_masks(1 << (groups - 1).bit_length()):
+        value = (value & low) | ((value & ~low) << (3 * s))
+    return value.to_bytes(groups, "big").translate(_B32_ENCODE)[:-(-len(data) * 8 // 5)]
+
+def inflate(data, max_size=MAX_INFLATED_SIZE):
+    """
+        Inflates zlib data with an incremental decompressor that stops as soon as the
+        output would exceed `max_size` bytes, so oversized payloads are rejected 
+        without being fully inflated. `max_size` None means no limit.
+    """
+    decompressor = zlib.decompressobj()
+    if max_size is None:
+        out = decompressor.decompress(data)
+    else:
+        # One byte more than allowed tells oversized payloads apart (0 would mean no limit to zlib)
+        out = decompressor.decompress(data, max_size + 1)
+        if len(out) > max_size:
+            raise Exception(f"Compressed payload inflates to more than {max_size} bytes")
+    if not decompressor.eof:
+        raise zlib.error("Error -5 while decompressing data: incomplete or truncated stream")
+    return out
+
+def decode_payload(barcode, max_inflated_size=MAX_INFLATED_SIZE):
+    """
+        Checks the magic number and decodes the flags and the Base32 (and zlib) layers 
+        of a barcode without going through Construct. Returns (flags, content). See
+        inflate() for `max_inflated_size`.
+    """
+    if len(barcode) < 5:
+        raise StreamError("stream read less than 5 bytes, the barcode is truncated")
+    if barcode[0:4] != b"NDB1":
+        raise ConstError(f"parsing expected b'NDB1' but parsed {bytes(barcode[0:4])}")
+    flags_value = barcode[4] - 0x41
+    flags = dict(signed=bool(flags_value & 1), compressed=bool(flags_value & 2))
+    if instrumentation.enabled:
+        instrumentation.add_bytes("barcode", len(barcode))
+        content = instrumentation.timed("base32", b32decode_unpadded, bytes(barcode[5:]))
+        if flags["compressed"]:
+            instrumentation.add_bytes("compressed", len(content))
+            content = instrumentation.timed("zlib", inflate, content, max_inflated_size)
+            instrumentation.add_bytes("inflated", len(content))
+        return flags, content
+
+    content = b32decode_unpadded(bytes(barcode[5:]))
+    if flags["compressed"]:
+        content = inflate(content, max_inflated_size)
+    return flags, content
+
 class Base32(Tunnel):
     def _decode(self, obj, context, path):
-        obj = obj + b"=" * ((8 - len(obj) % 8) % 8)
-        return base64.b32decode(obj)
+        if instrumentation.enabled:
+            return instrumentation.timed("base32", b32decode_unpadded, obj)
+        return b32decode_unpadded(obj)
+
+    def _encode(self, obj, context, path):
+        if instrumentation.enabled:
+            return instrumentation.timed("base32", b32encode_unpadded, obj)
+        return b32encode_unpadded(obj)
+
+class Zlib(Tunnel):
+    """ Same as Compressed(subcon, "zlib", level), but inflating through inflate(). """
+    def __init__(self, subcon, level=9, max_size=MAX_INFLATED_SIZE):
+        super().__init__(subcon)
+        self.level = level
+        self.max_size = max_size
+
+    def _decode(self, obj, context, path):
+        if instrumentation.enabled:
+            return instrumentation.timed("zlib", inflate, obj, self.max_size)
+        return inflate(obj, self.max_size)
 
     def _encode(self, obj, context, path):
-        return base64.b32encode(obj).strip(b"=")
+        if instrumentation.enabled:
+            instrumentation.add_bytes("inflated", len(obj))
+            data = instrumentation.timed("zlib", zlib.compress, obj, self.level)
+            instrumentation.add_bytes("compressed", len(data))
+            return data
+        return zlib.compress(obj, self.level)
+
+C40_CHARSET = "*** 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+_c40_decode_table = None
+_c40_encode_table = None
+
+def _c40_tables():
+    """
+        Lookup tables for the C40 codec, built on first use. The decoding table maps 
+        every 16 bit pair to its (up to three characters) triplet, using the same 
+        arithmetic as the original per-character implementation so that even malformed
+        pairs decode identically; pairs that do not map to the character set are None.
+        The encoding table maps every byte to its C40 value, or 0xFF if the byte is 
+        not part of the character set.
+    """
+    global _c40_decode_table, _c40_encode_table
+    if _c40_decode_table is None:
+        decode = [None] * 65536
+        for u in range(65536):
+            u1 = int((u - 1) / 1600)
+            u2 = int((u - (u1 * 1600) - 1) / 40)
+            u3 = int(u - (u1 * 1600) - (u2 * 40) - 1)
+            if u1 < len(C40_CHARSET):
+                decode[u] = C40_CHARSET[u1] + C40_CHARSET[u2] + (C40_CHARSET[u3] if u3 != 0 else "")
+        encode = bytearray(b"\xff" * 256)
+        for b in range(256):
+            if chr(b) in C40_CHARSET:
+                encode[b] = C40_CHARSET.index(chr(b))
+        _c40_encode_table = bytes(encode)
+        _c40_decode_table = decode
+    return _c40_decode_table, _c40_encode_table
+
+def c40_decode(data):
+    decode, _ = _c40_tables()
+    if len(data) % 2:
+        data = bytes(data) + b"\x00"
+    words = struct.unpack(f">{len(data) // 2}H", data)
+    try:
+        return "".join(map(decode.__getitem__, words))
+    except TypeError:
+        pass
+
+    # Slow path: trailing single character (0xFE) or invalid pairs
+    output = []
+    for u in words:
+        if u >> 8 == 254:
+            output.append(chr((u & 0xFF) - 1))
+            break
+        if decode[u] is None:
+            raise MappingError(f"invalid C40 value {u:#06x}")
+        output.append(decode[u])
+    return "".join(output)
+
+def c40_encode(text):
+    _, encode = _c40_tables()
+    raw = text.encode()
+    values = raw.translate(encode)
+    if 0xFF in values:
+        return _c40_encode_checked(raw, encode)
+
+    full = len(values) - len(values) % 3
+    output = struct.pack(f">{full // 3}H", *[1600*u1 + 40*u2 + u3 + 1 for u1, u2, u3 in 
+                                             zip(values[0:full:3], values[1:full:3], values[2:full:3])])
+    if len(values) - full == 2:
+        output += (1600*values[full] + 40*values[full + 1] + 1).to_bytes(2, "big")
+    elif len(values) - full == 1:
+        output += b"\xfe" + (raw[full] + 1).to_bytes(1, "big")
+    return output
+
+def _c40_encode_checked(raw, encode):
+    # Per-triplet encoding, only used when the input contains characters outside of 
+    # the character set, to reproduce the exact behaviour of the reference encoder.
+    output = bytearray()
+    for u1, u2, u3 in [(raw[i:] + b"\x00\x00")[0:3] for i in range(0, len(raw), 3)]:
+        if u2 == 0:
+            output += b"\xfe" + (u1 + 1).to_bytes(1, "big")
+            break
+        for c in (u1, u2, u3) if u3 != 0 else (u1, u2):
+            if encode[c] == 0xFF:
+                raise ValueError(f"character {chr(c)!r} is not part of the C40 character set")
+        u = 1600*encode[u1] + 40*encode[u2] + (0 if u3 == 0 else encode[u3]) + 1
+        output += u.to_bytes(2, "big")
+    return bytes(output)
+
+_c40_batch_table = None
+
+def _c40_batch_decode_table():
+    """
+        Copy of the decoding table for c40_decode_many(): the invalid pair 0xFFFF,
+        used to join items, decodes to a line feed, and the trailing single character
+        pairs (0xFE) of the character set decode to the character followed by NUL, to
+        check that they end their item. Neither character is part of the set.
+    """
+    global _c40_batch_table
+    if _c40_batch_table is None:
+        decode, _ = _c40_tables()
+        table = list(decode)
+        for c in C40_CHARSET:
+            table[0xFE00 | (ord(c) + 1)] = c + "\x00"
+        table[0xFFFF] = "\n"
+        _c40_batch_table = table
+    return _c40_batch_table
+
+def c40_decode_many(items):
+    """
+        Decodes an iterable of C40 byte strings, returns a list of strings. The items
+        are joined with the pair 0xFFFF, then decoded and split in a single pass.
+        Items with invalid pairs are decoded by c40_decode().
+    """
+    table = _c40_batch_decode_table()
+    items = [bytes(data) for data in items]
+    if any(len(data) % 2 for data in items):
+        return [c40_decode(data) for data in items]
+
+    joined = b"\xff\xff".join(items)
+    try:
+        text = "".join(map(table.__getitem__, struct.unpack(f">{len(joined) // 2}H", joined)))
+    except TypeError:
+        return [c40_decode(data) for data in items]
+    output = text.split("\n")
+    if len(output) != len(items):
+        # A 0xFFFF pair inside an item
+        return [c40_decode(data) for data in items]
+    if "\x00" in text:
+        for i, item in enumerate(output):
+            if "\x00" in item:
+                # c40_decode() stops at the first trailing single character
+                output[i] = item[:-1] if item.find("\x00") == len(item) - 1 else c40_decode(items[i])
+    return output
+
+def c40_encode_many(items):
+    """
+        Encodes an iterable of strings, returns a list of C40 byte strings. The items
+        are joined, mapped to C40 values and their full triplets packed in a single
+        pass. Batches with characters outside the character set are encoded item by
+        item, to raise the same errors as c40_encode().
+    """
+    _, encode = _c40_tables()
+    texts = list(items)
+    raws = [text.encode() for text in texts]
+    values = b"".join(raws).translate(encode)
+    if 0xFF in values:
+        return [c40_encode(text) for text in texts]
+
+    # Values of the full triplets of every item, followed by the 0 to 2 remaining ones
+    full_values = bytearray()
+    start = 0
+    for raw in raws:
+        full_values += values[start:start + len(raw) - len(raw) % 3]
+        start += len(raw)
+    packed = struct.pack(f">{len(full_values) // 3}H", *[1600*u1 + 40*u2 + u3 + 1 for u1, u2, u3 in
+                                                        zip(full_values[0::3], full_values[1::3], full_values[2::3])])
+
+    output = []
+    start = packed_start = 0
+    for raw in raws:
+        full = len(raw) - len(raw) % 3
+        packed_end = packed_start + full // 3 * 2
+        item = packed[packed_start:packed_end]
+        if len(raw) - full == 2:
+            item += (1600*values[start + full] + 40*values[start + full + 1] + 1).to_bytes(2, "big")
+        elif len(raw) - full == 1:
+            item += b"\xfe" + (raw[full] + 1).to_bytes(1, "big")
+        output.append(item)
+        start += len(raw)
+        packed_start = packed_end
+    return output
 
 class C40(Adapter):
     """ 
@@ -68,33 +370,14 @@ class C40(Adapter):
         numbers and space). No other symbols are allowed.
     """
     def _decode(self, obj, context, path):
-        chset = "*** 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-        output = ''
-        for b1, b2  in [(obj[i:] + b"\x00")[0:2] for i in range(0, len(obj), 2)]:
-            if b1 == 254:
-                output += chr(b2 - 1)
-                break
-            u = (b1 * 256) + b2
-            u1 = int((u - 1) / 1600)
-            u2 = int((u - (u1 * 1600) - 1) / 40)
-            u3 = int(u - (u1 * 1600) - (u2 * 40) - 1)
-            output += chset[u1] + chset[u2] + (chset[u3] if u3 != 0 else "")
-        return output
+        if instrumentation.enabled:
+            return instrumentation.timed("c40", c40_decode, obj)
+        return c40_decode(obj)
 
     def _encode(self, obj, context, path):
-        obj = obj.encode()
-        chset = "*** 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-        output = b''
-        for u1, u2, u3 in [(obj[i:] + b"\x00\x00")[0:3] for i in range(0, len(obj), 3)]:
-            if u2 == 0:
-                output += b"\xfe" + (u1 + 1).to_bytes(1, "big")
-                break
-            u1 = chset.index(chr(u1))
-            u2 = chset.index(chr(u2))
-            u3 = 0 if u3 == 0 else chset.index(chr(u3))
-            u = 1600*u1 + 40*u2 + u3 + 1
-            output += int(u / 256).to_bytes(1, "big") + int(u % 256).to_bytes(1, "big")
-        return output
+        if instrumentation.enabled:
+            return instrumentation.timed("c40", c40_encode, obj)
+        return c40_encode(obj)
 
 class StripLT(Adapter):
     def _decode(self, obj, context, path):
@@ -103,19 +386,37 @@ class StripLT(Adapter):
     def _encode(self, obj, context, path):
         return obj.replace("<", " ")
     
+def decode_date(obj):
+    mask = obj[0]
+    # Unknown digits are stored as 0, so several leading zeros are possible ("XXXX1990")
+    string_date = str(int.from_bytes(obj[1:], signed=False)).zfill(8)
+
+    for i in range(8):
+        if (mask >> i) & 1:
+            string_date = string_date[:i] + "X" + string_date[i+1:]
+    return string_date[4:] + "-" + string_date[0:2] + "-" + string_date[2:4]
+
+def encode_date(text):
+    """ Inverse of decode_date(): "YYYY-MM-DD", with X for unknown digits, to the 4 bytes form. """
+    if len(text) != 10 or text[4] != "-" or text[7] != "-":
+        raise ValueError(f"date expected as YYYY-MM-DD, found {text!r}")
+    string_date = text[5:7] + text[8:10] + text[0:4]
+    mask = 0
+    for i in range(8):
+        if string_date[i] == "X":
+            mask |= 1 << i
+    return mask.to_bytes(1, "big") + int(string_date.replace("X", "0")).to_bytes(3, "big")
+
 class Date(Adapter):
     def _decode(self, obj, context, path):
-        mask = obj[0]
-        string_date = str(int.from_bytes(obj[1:], signed=False))
-        if len(string_date) == 7:
-            string_date = "0" + string_date
-
-        for i in range(8):
-            if (mask >> i) & 1:
-                string_date = string_date[:i] + "X" + string_date[i+1:]
-        return string_date[4:] + "-" + string_date[0:2] + "-" + string_date[2:4]
+        if instrumentation.enabled:
+            return instrumentation.timed("date", decode_date, obj)
+        return decode_date(obj)
 
     def _encode(self, obj, context, path):
-        # Not needed at the moment, expected input is 
-        # unknown_mask_byte + int(THE_DATE.strftime("%m%d%Y")).to_bytes(3)
+        # Expected input is unknown_mask_byte + int(THE_DATE.strftime("%m%d%Y")).to_bytes(3),
+        # the "YYYY-MM-DD" strings produced by _decode (with X for unknown digits) 
+        # are accepted as well.
+        if isinstance(obj, str):
+            return encode_date(obj)
         return obj
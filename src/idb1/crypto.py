@@ -0,0 +1,233 @@
+"""
+    ECDSA backends. Keys are loaded through a backend and wrapped in PublicKey and
+    PrivateKey, which sign and verify signatures in the raw r || s form stored in
+    barcodes, with the hash functions of SIGNING_ALGOS:
+
+        key = load_public_key(der)
+        key.verify(signature, data, hashfunc=sha256)
+        key.verify_digest(signature, sha256(data).digest(), hashfunc=sha256)
+
+    Two backends are provided: "ecdsa" (pure Python, always available) and
+    "cryptography" (OpenSSL, several times faster, used when the package is
+    installed). The default is the fastest available one, unless another is named
+    by the IDB1_CRYPTO_BACKEND environment variable. Keys are pickled as DER and
+    loaded again with the same backend, so they can be handed to worker processes.
+"""
+import os
+from threading import Lock
+
+class EcdsaBackend:
+    name = "ecdsa"
+
+    def __init__(self):
+        import ecdsa
+        self._ecdsa = ecdsa
+
+    def load_public_key(self, der, precompute=False):
+        vk = self._ecdsa.VerifyingKey.from_der(der)
+        return precomputed_key(vk) if precompute else vk
+
+    def load_private_key(self, der):
+        return self._ecdsa.SigningKey.from_der(der)
+
+    def key_size(self, key):
+        return key.curve.baselen * 8
+
+    def public_point(self, key):
+        if isinstance(key, self._ecdsa.SigningKey):
+            key = key.get_verifying_key()
+        point = key.pubkey.point
+        return point.x(), point.y()
+
+    def sign(self, key, data, hashfunc):
+        return key.sign(data, hashfunc=hashfunc)
+
+    def verify_digest(self, key, signature, digest, hashfunc):
+        try:
+            # Like verify(), digests longer than the curve order are truncated
+            return key.verify_digest(signature, digest, allow_truncate=True)
+        except self._ecdsa.BadSignatureError:
+            return False
+
+class CryptographyBackend:
+    name = "cryptography"
+
+    def __init__(self):
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec, utils
+        self._invalid_signature = InvalidSignature
+        self._hashes = hashes
+        self._serialization = serialization
+        self._ec = ec
+        self._utils = utils
+        self._algorithms = dict()
+
+    def _algorithm(self, hashfunc, prehashed=False):
+        algorithm = self._algorithms.get((hashfunc, prehashed))
+        if algorithm is None:
+            hash_algorithm = getattr(self._hashes, hashfunc().name.upper())()
+            algorithm = self._algorithms[(hashfunc, prehashed)] = self._ec.ECDSA(
+                self._utils.Prehashed(hash_algorithm) if prehashed else hash_algorithm)
+        return algorithm
+
+    def load_public_key(self, der, precompute=False):
+        key = self._serialization.load_der_public_key(der)
+        if not isinstance(key, self._ec.EllipticCurvePublicKey):
+            raise Exception("Not an ECDSA public key")
+        return key
+
+    def load_private_key(self, der):
+        key = self._serialization.load_der_private_key(der, password=None)
+        if not isinstance(key, self._ec.EllipticCurvePrivateKey):
+            raise Exception("Not an ECDSA private key")
+        return key
+
+    def key_size(self, key):
+        return key.curve.key_size
+
+    def public_point(self, key):
+        if isinstance(key, self._ec.EllipticCurvePrivateKey):
+            key = key.public_key()
+        numbers = key.public_numbers()
+        return numbers.x, numbers.y
+
+    def sign(self, key, data, hashfunc):
+        r, s = self._utils.decode_dss_signature(key.sign(data, self._algorithm(hashfunc)))
+        size = (key.curve.key_size + 7) // 8
+        return r.to_bytes(size, "big") + s.to_bytes(size, "big")
+
+    def verify_digest(self, key, signature, digest, hashfunc):
+        size = (key.curve.key_size + 7) // 8
+        if len(signature) != 2 * size:
+            return False
+        r = int.from_bytes(signature[:size], "big")
+        s = int.from_bytes(signature[size:], "big")
+        try:
+            key.verify(self._utils.encode_dss_signature(r, s), digest, self._algorithm(hashfunc, prehashed=True))
+            return True
+        except self._invalid_signature:
+            return False
+
+# Fastest first
+BACKENDS = dict(cryptography=CryptographyBackend, ecdsa=EcdsaBackend)
+
+_backends = dict()
+_backends_lock = Lock()
+
+def get_backend(name=None):
+    """ Returns a backend by name, or the default one (see above). """
+    if name is None:
+        name = os.environ.get("IDB1_CRYPTO_BACKEND")
+    if name is None:
+        for candidate in BACKENDS:
+            try:
+                return get_backend(candidate)
+            except ImportError:
+                continue
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name not in BACKENDS:
+                raise Exception(f"Unknown crypto backend {name}")
+            backend = _backends[name] = BACKENDS[name]()
+        return backend
+
+def available_backends():
+    names = []
+    for name in BACKENDS:
+        try:
+            get_backend(name)
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+def precomputed_key(vk):
+    """
+        Returns a copy of an ecdsa VerifyingKey with the multiplication tables
+        precomputed, which halves the verification time. VerifyingKey.precompute()
+        cannot be used directly on keys loaded with from_der(), as their point does
+        not carry the curve order.
+    """
+    from ecdsa import VerifyingKey
+    from ecdsa.ellipticcurve import PointJacobi
+    point = vk.pubkey.point
+    vk = VerifyingKey.from_public_point(
+        PointJacobi(point.curve(), point.x(), point.y(), 1, vk.curve.order, generator=True),
+        curve=vk.curve)
+    vk.precompute()
+    return vk
+
+class PublicKey:
+    def __init__(self, backend, key, der, precompute=False):
+        self.backend = backend
+        self.key = key
+        self.der = der
+        self.precompute = precompute
+
+    @property
+    def key_size(self):
+        return self.backend.key_size(self.key)
+
+    def point(self):
+        return self.backend.public_point(self.key)
+
+    def verify(self, signature, data, hashfunc):
+        """ Returns whether `signature` is valid for `data`. """
+        return self.backend.verify_digest(self.key, signature, hashfunc(data).digest(), hashfunc)
+
+    def verify_digest(self, signature, digest, hashfunc):
+        """ Same as verify(), for data already hashed with `hashfunc`. """
+        return self.backend.verify_digest(self.key, signature, digest, hashfunc)
+
+    def __reduce__(self):
+        return load_public_key, (self.der, self.backend.name, self.precompute)
+
+class PrivateKey:
+    def __init__(self, backend, key, der):
+        self.backend = backend
+        self.key = key
+        self.der = der
+
+    @property
+    def key_size(self):
+        return self.backend.key_size(self.key)
+
+    def point(self):
+        """ The public point, to check the key against a certificate. """
+        return self.backend.public_point(self.key)
+
+    def sign(self, data, hashfunc):
+        return self.backend.sign(self.key, data, hashfunc)
+
+    def __reduce__(self):
+        return load_private_key, (self.der, self.backend.name)
+
+def _backend(backend):
+    # A backend instance or a name
+    return get_backend(backend) if backend is None or isinstance(backend, str) else backend
+
+def load_public_key(der, backend=None, precompute=False):
+    """
+        Loads a DER public key. With `precompute`, backends that support it spend
+        more time loading the key to verify faster (for long-lived keys).
+    """
+    backend = _backend(backend)
+    der = bytes(der)
+    return PublicKey(backend, backend.load_public_key(der, precompute), der, precompute)
+
+def load_private_key(der, backend=None):
+    backend = _backend(backend)
+    der = bytes(der)
+    return PrivateKey(backend, backend.load_private_key(der), der)
+
+def as_public_key(vk, backend=None):
+    """ Returns a PublicKey for DER bytes, a PublicKey or an ecdsa VerifyingKey. """
+    if isinstance(vk, PublicKey):
+        return vk
+    if isinstance(vk, (bytes, bytearray, memoryview)):
+        return load_public_key(vk, backend)
+    if hasattr(vk, "to_der") and hasattr(vk, "verify_digest"):
+        return PublicKey(get_backend("ecdsa"), vk, vk.to_der())
+    raise Exception("Invalid ECDSA public key (DER format expected)")
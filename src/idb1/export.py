@@ -0,0 +1,228 @@
+"""
+    Columnar export of decoded barcodes for analytics:
+
+        python -m idb1.export [--public FILE] [--trust-dir DIR] [--photo-dir DIR] [--row-group-size 65536]
+                              [--workers N] [--compression zstd] OUTPUT.parquet [FILE ...]
+
+    Barcodes (one per line, from the given files or stdin) are decoded with the
+    fast path straight into Arrow record batches with the typed schema returned by
+    arrow_schema(): one flat row per barcode, with the flags, the header, the
+    message and the EU visa fields. Dates are date32; a date with unknown digits
+    (allowed by ICAO for the date of birth) is null, and its decoded "YYYY-XX-XX"
+    text is kept in the date_of_birth_text column. Barcodes that fail to decode
+    give a row with only the index, the length and the error columns set.
+
+    Photos are never stored in the table, only their size and SHA-256 digest; with
+    `photo_dir` they are written out of line to <photo_dir>/<sha256 hex>, one file
+    per distinct photo. Batches of `row_group_size` rows are decoded on a process
+    pool (see idb1.batch.map_chunks) and written as Parquet row groups as they come,
+    so memory stays bounded whatever the input length.
+"""
+import argparse
+import hashlib
+import os
+import sys
+from datetime import date
+from idb1.batch import map_chunks
+from idb1.parser import parse
+from idb1.records import TEXT_FIELDS
+
+_TEXT, _DATE, _BOOL, _UINT8, _INT32, _INT64, _DIGEST, _REFERENCE, _ENUM = range(9)
+
+EU_VISA_COLUMNS = [
+    ("issuing_member_state",     _TEXT),
+    ("full_name",                _TEXT),
+    ("surname_at_birth",         _TEXT),
+    ("date_of_birth",            _DATE),
+    ("country_of_birth",         _TEXT),
+    ("place_of_birth",           _TEXT),
+    ("sex",                      _TEXT),
+    ("nationality",              _TEXT),
+    ("nationality_at_birth",     _TEXT),
+    ("td_type",                  _TEXT),
+    ("td_number",                _TEXT),
+    ("td_issuing_authority",     _TEXT),
+    ("td_date.issue",            _DATE),
+    ("td_date.expiry",           _DATE),
+    ("visa_issuing_authority",   _TEXT),
+    ("visa_authority_location",  _TEXT),
+    ("visa_issued_on_behalf",    _TEXT),
+    ("visa_place_of_decision",   _TEXT),
+    ("visa_date_of_decision",    _DATE),
+    ("visa_type",                _TEXT),
+    ("visa_limited_validity",    _BOOL),
+    ("visa_number",              _TEXT),
+    ("visa_date.commencement",   _DATE),
+    ("visa_date.expiry",         _DATE),
+    ("visa_n_of_entries",        _UINT8),
+    ("visa_eueea_family_member", _BOOL),
+    ("visa_euuk_family_member",  _BOOL),
+    ("visa_comments",            _TEXT),
+]
+
+# (column name, type); nested fields are flattened with "_" (td_date.issue -> td_date_issue)
+COLUMNS = [
+    ("index",                   _INT64),
+    ("barcode_length",          _INT32),
+    ("error",                   _ENUM),
+    ("error_message",           _TEXT),
+    ("signed",                  _BOOL),
+    ("compressed",              _BOOL),
+    ("signature",               _ENUM),
+    ("country_identifier",      _TEXT),
+    ("signature_algorithm",     _ENUM),
+    ("certificate_reference",   _REFERENCE),
+    ("signature_creation_date", _DATE),
+    ("mrz_td1",                 _TEXT),
+    ("mrz_td3",                 _TEXT),
+    ("can",                     _TEXT),
+    ("message_photo_size",      _INT32),
+    ("message_photo_sha256",    _DIGEST),
+] + [(name.replace(".", "_"), kind) for name, kind in EU_VISA_COLUMNS] + [
+    ("date_of_birth_text",      _TEXT),
+    ("photo_size",              _INT32),
+    ("photo_sha256",            _DIGEST),
+]
+
+def arrow_schema():
+    import pyarrow as pa
+    types = {
+        _TEXT:      pa.string(),
+        _DATE:      pa.date32(),
+        _BOOL:      pa.bool_(),
+        _UINT8:     pa.uint8(),
+        _INT32:     pa.int32(),
+        _INT64:     pa.int64(),
+        _DIGEST:    pa.binary(32),
+        _REFERENCE: pa.binary(5),
+        _ENUM:      pa.dictionary(pa.int8(), pa.string()),
+    }
+    return pa.schema([pa.field(name, types[kind], nullable=(name != "index")) for name, kind in COLUMNS])
+
+_trust_store = None
+_photo_dir = None
+
+def _init_exporter(trust_store, photo_dir):
+    global _trust_store, _photo_dir
+    _trust_store = trust_store
+    _photo_dir = photo_dir
+
+def _date(value):
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        # Unknown digits
+        return None
+
+def _photo(data):
+    if data is None:
+        return None, None
+    digest = hashlib.sha256(data).digest()
+    if _photo_dir is not None:
+        path = os.path.join(_photo_dir, digest.hex())
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+    return len(data), digest
+
+def _row(index, barcode, parsed):
+    flags = parsed["flags"]
+    content = parsed["content"]
+    header = content["signable"]["header"]
+    message = content["signable"]["message"]
+    eu_visa = message.get("eu_visa", {})
+    algorithm = header.get("signature_algorithm")
+
+    row = [index, len(barcode), None, None, flags.get("signed", False), flags.get("compressed", False),
+           _trust_store.signature_status(parsed) if _trust_store is not None else None,
+           header["country_identifier"], str(algorithm) if algorithm is not None else None,
+           header.get("certificate_reference"), _date(header.get("signature_creation_date")),
+           message.get("mrz_td1"), message.get("mrz_td3"), message.get("can"), *_photo(message.get("photo"))]
+    for name, kind in EU_VISA_COLUMNS:
+        group, _, name = name.rpartition(".")
+        value = (eu_visa.get(group) or {}).get(name) if group else eu_visa.get(name)
+        if kind == _DATE:
+            value = _date(value)
+        elif kind == _BOOL:
+            value = bool(value)
+        elif name in TEXT_FIELDS and value is not None:
+            value = value.decode("ascii", "replace")
+        row.append(value)
+    date_of_birth = eu_visa.get("date_of_birth")
+    row.append(date_of_birth if date_of_birth is not None and "X" in date_of_birth else None)
+    row.extend(_photo(eu_visa.get("photo")))
+    return row
+
+def _error_row(index, barcode, e):
+    return [index, len(barcode), type(e).__name__, str(e)] + [None] * (len(COLUMNS) - 4)
+
+def _export_chunk(start, barcodes):
+    import pyarrow as pa
+    rows = []
+    for index, barcode in enumerate(barcodes, start):
+        barcode = barcode.strip()
+        try:
+            rows.append(_row(index, barcode, parse(barcode, fast=True)))
+        except Exception as e:
+            rows.append(_error_row(index, barcode, e))
+    schema = arrow_schema()
+    columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+    return [pa.RecordBatch.from_arrays(columns, schema=schema)]
+
+def record_batches(barcodes, trust_store=None, photo_dir=None, batch_size=65536, workers=None):
+    """
+        Decodes an iterable of barcodes into Arrow record batches of at most
+        `batch_size` rows, in input order. A "signature" status is filled in when a
+        trust store is given.
+    """
+    if photo_dir is not None:
+        os.makedirs(photo_dir, exist_ok=True)
+    return map_chunks(_export_chunk, barcodes, workers=workers, chunksize=batch_size,
+                      initializer=_init_exporter, initargs=(trust_store, photo_dir))
+
+def write_parquet(barcodes, path, trust_store=None, photo_dir=None, row_group_size=65536, workers=None,
+                  compression="zstd"):
+    """ Writes the decoded barcodes to a Parquet file, one row group per batch; returns the number of rows. """
+    import pyarrow.parquet as pq
+    rows = 0
+    with pq.ParquetWriter(path, arrow_schema(), compression=compression) as writer:
+        for batch in record_batches(barcodes, trust_store, photo_dir, row_group_size, workers):
+            writer.write_batch(batch, row_group_size=row_group_size)
+            rows += batch.num_rows
+    return rows
+
+def main(argv=None):
+    from idb1.cli import _read_lines
+    parser = argparse.ArgumentParser(prog="idb1-export", description="Exports decoded barcodes to a Parquet file.")
+    parser.add_argument("--public", type=argparse.FileType("rb"), help="trusted signer certificate (DER)")
+    parser.add_argument("--trust-dir", help="directory of trusted signer certificates (*.der)")
+    parser.add_argument("--photo-dir", help="write photos to this directory, named by their SHA-256")
+    parser.add_argument("--row-group-size", type=int, default=65536, help="rows per row group (default: 65536)")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--compression", default="zstd", help="Parquet compression codec (default: zstd)")
+    parser.add_argument("output", metavar="OUTPUT", help="Parquet file to write")
+    parser.add_argument("files", nargs="*", metavar="FILE", help="input files (default: stdin)")
+    args = parser.parse_args(argv)
+
+    trust_store = None
+    if args.public or args.trust_dir:
+        from idb1.trust import TrustStore
+        try:
+            trust_store = TrustStore.from_directory(args.trust_dir) if args.trust_dir else TrustStore()
+            if args.public:
+                trust_store.add(args.public.read())
+        except Exception as e:
+            parser.error(str(e))
+
+    barcodes = (line for line in _read_lines(args.files, binary=True) if line.strip())
+    rows = write_parquet(barcodes, args.output, trust_store=trust_store, photo_dir=args.photo_dir,
+                         row_group_size=args.row_group_size, workers=args.workers, compression=args.compression)
+    print(f"idb1-export: {rows} rows written to {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
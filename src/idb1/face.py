@@ -0,0 +1,79 @@
+"""
+    Face detection and cropping for visa photos. Detected facial areas are cached
+    by the SHA-1 of the encoded image, so that cropping the same photo again (e.g.
+    with another margin, or on a GUI rerun) does not run the detector. DeepFace is
+    imported on first use and keeps its detector model loaded between calls;
+    detections are serialised as the model is not safe to share between threads.
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from io import BytesIO
+from threading import Lock
+from PIL import Image
+
+DETECTOR_BACKEND = "opencv"
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+_detector_lock = Lock()
+cache_size = 256
+
+def _read(image):
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read()
+    return image.getvalue() if hasattr(image, "getvalue") else image.read()
+
+def _detect(data, detector_backend):
+    import numpy as np
+    from deepface import DeepFace
+    img = np.array(Image.open(BytesIO(data)).convert("RGB"))[:, :, ::-1].copy()
+    with _detector_lock:
+        try:
+            detections = DeepFace.extract_faces(img_path=img, detector_backend=detector_backend)
+        except Exception as e:
+            raise Exception("No facial features found in this picture.") from e
+    area = detections[0]["facial_area"]
+    return area["x"], area["y"], area["w"], area["h"]
+
+def facial_area(image, detector_backend=DETECTOR_BACKEND):
+    """
+        Returns the (x, y, w, h) area of the first face found in `image` (encoded
+        bytes, a path or a file-like object). Raises if no face is found.
+    """
+    data = _read(image)
+    key = (sha1(data).digest(), detector_backend)
+    with _cache_lock:
+        area = _cache.get(key)
+        if area is not None:
+            _cache.move_to_end(key)
+            return area
+    area = _detect(data, detector_backend)
+    with _cache_lock:
+        _cache[key] = area
+        while len(_cache) > cache_size:
+            _cache.popitem(last=False)
+    return area
+
+def crop_face(img, area, margin=0):
+    """ Crops the PIL image `img` to a facial area, extended by `margin` pixels. """
+    x, y, w, h = area
+    return img.crop((max(x - margin, 0), max(y - margin, 0), x + w + margin, y + h + margin))
+
+def crop_faces(images, margin=0, detector_backend=DETECTOR_BACKEND):
+    """
+        Crops the face of every image (encoded bytes, paths or file-like objects),
+        returning the cropped PIL images in order, or the exception for images in
+        which no face is found.
+    """
+    out = []
+    for image in images:
+        try:
+            data = _read(image)
+            area = facial_area(data, detector_backend)
+            out.append(crop_face(Image.open(BytesIO(data)), area, margin))
+        except Exception as e:
+            out.append(e)
+    return out
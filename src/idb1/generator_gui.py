@@ -1,13 +1,52 @@
-from idb1.parser import build, parse
+from idb1.parser import parse, Signer
+from idb1.incremental import IncrementalBuilder
+from datetime import date
 import streamlit as st
-from qrcode import QRCode
+from qrcode import QRCode, constants
 from io import BytesIO
-import subprocess
+from idb1.jabcode import JabRenderer
+from idb1.photo import encode, fit_photo
 from PIL import Image
-from deepface import DeepFace
+from idb1.face import facial_area, crop_face
 
 MEMBER_STATES = ["AUT","BEL","BGR","HRV","CYP","CZE","DNK","EST","FIN","FRA","DEU","GRC","HUN","IRL","ITA","LVA","LTU","LUX","MLT","NLD","POL","PRT","ROU","SVK","SVN","ESP","SWE"]
 
+@st.cache_resource
+def jab_renderer():
+    return JabRenderer("./bin/jabcodeWriter")
+
+# Reruns only recompute the stages whose inputs changed: the keys are parsed once
+# per (key, certificate) pair, barcodes are cached by their input object and keys,
+# parsed data and QR images by the barcode.
+@st.cache_resource(max_entries=8)
+def get_signer(sk, vk, include_cert):
+    return Signer(sk, vk, include_cert=include_cert)
+
+# Field edits only re-encode the edited field (see idb1.incremental)
+@st.cache_resource
+def incremental_builder():
+    return IncrementalBuilder()
+
+@st.cache_data(max_entries=64)
+def build_barcode(obj, sk, vk, include_cert, day):
+    # `day` renews cached signed barcodes when their signature creation date changes
+    signer = get_signer(sk, vk, include_cert) if obj["flags"]["signed"] is True else None
+    return incremental_builder().build(obj, signer)
+
+@st.cache_data(max_entries=64)
+def parse_barcode(data, vk):
+    return parse(data, vk=vk)
+
+@st.cache_data(max_entries=64)
+def render_qr(data, version, error_correction):
+    qr = QRCode(version=version, error_correction=error_correction, border=0)
+    qr.add_data(data)
+    qr.make(fit=False)
+    img = qr.make_image()
+    buf = BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
 st.set_page_config(layout="wide", page_title="EU Visa IDB Barcode Demo", page_icon="🇪🇺")
 st.title("🇪🇺 EU Visa IDB Barcode Demo ✨", text_alignment="center")
 col1, col2 = st.columns([3, 2])
@@ -82,7 +121,11 @@ with col1:
                         raise Exception("Invalid image file.") from e
             
                     visa_photo = visa_photo_original
-                    visa_photo_width_scale = st.slider("Width Scale (%)", min_value=1, max_value=100, value=100)
+                    visa_photo_fit = st.checkbox("Fit to a byte budget", value=False)
+                    if visa_photo_fit:
+                        visa_photo_budget = st.number_input("Photo budget (bytes)", min_value=100, max_value=20000, value=1000, step=50)
+                    else:
+                        visa_photo_width_scale = st.slider("Width Scale (%)", min_value=1, max_value=100, value=100)
 
                     sc1, sc2, sc3 = st.columns([1, 1, 3])
                     with sc1:
@@ -93,39 +136,28 @@ with col1:
                         visa_photo_crop = st.checkbox("Crop Face", value=False)
                     with sc3:
                         if visa_photo_crop:
-                            try:
-                                detections = DeepFace.extract_faces(
-                                    img_path=visa_photo_original,
-                                )
-                            except Exception as e:
-                                raise Exception("No facial features found in this picture.") from e
-
-                            x = detections[0]["facial_area"]["x"]
-                            y = detections[0]["facial_area"]["y"]
-                            w = detections[0]["facial_area"]["w"]
-                            h = detections[0]["facial_area"]["h"]
-
+                            area = facial_area(visa_photo_original.getvalue())
                             visa_photo_crop_padding = st.slider("Crop Margin (pixels)", min_value=0, max_value=50, value=0)
-                            left = max(x - visa_photo_crop_padding, 0)
-                            top = max(y - visa_photo_crop_padding, 0)
-                            right = x + w + visa_photo_crop_padding
-                            bottom = y + h + visa_photo_crop_padding
-
-                            img = img.crop((left, top, right, bottom))
+                            img = crop_face(img, area, visa_photo_crop_padding)
 
-                    visa_photo_compression_speed = None
-                    sc1, sc2 = st.columns([1, 4])
-                    with sc1:
-                        visa_photo_compression_algo = st.selectbox("Compression Algorithm", options=["AVIF", "JPEG", "JPEG2000", "WEBP"], index=0)
-                        if visa_photo_compression_algo == "AVIF":
-                                visa_photo_compression_speed = st.slider("Compression Speed", min_value=0, max_value=10, value=6)
-                        if visa_photo_compression_algo == "WEBP":
-                                visa_photo_compression_speed = 6 - st.slider("Compression Speed", min_value=0, max_value=6, value=4)
-                    with sc2:
-                        visa_photo_avif_quality = st.slider("Compression Quality", min_value=0, max_value=100, value=20)                   
+                    if visa_photo_fit:
+                        fitted = fit_photo(img, visa_photo_budget, grayscale=visa_photo_grayscale)
+                        visa_photo = fitted.data
+                        st.caption(f"{fitted.format}, scale {fitted.scale:.0%}, quality {fitted.quality}, PSNR {fitted.psnr:.1f} dB")
+                    else:
+                        visa_photo_compression_speed = None
+                        sc1, sc2 = st.columns([1, 4])
+                        with sc1:
+                            visa_photo_compression_algo = st.selectbox("Compression Algorithm", options=["AVIF", "JPEG", "JPEG2000", "WEBP"], index=0)
+                            if visa_photo_compression_algo == "AVIF":
+                                    visa_photo_compression_speed = st.slider("Compression Speed", min_value=0, max_value=10, value=6)
+                            if visa_photo_compression_algo == "WEBP":
+                                    visa_photo_compression_speed = 6 - st.slider("Compression Speed", min_value=0, max_value=6, value=4)
+                        with sc2:
+                            visa_photo_avif_quality = st.slider("Compression Quality", min_value=0, max_value=100, value=20)                   
+                        visa_photo = encode(img, visa_photo_compression_algo, visa_photo_width_scale / 100, visa_photo_avif_quality, visa_photo_compression_speed)
 
                     st.divider()
-                    img = img.resize((int(img.width * visa_photo_width_scale / 100), int(img.height * visa_photo_width_scale / 100)))
                     sc1, sc2 = st.columns(2)
                     with sc1:
                         original = Image.open(visa_photo_original)
@@ -133,29 +165,19 @@ with col1:
                         with st.container(horizontal_alignment="center"):
                             st.image(original)
                     with sc2:
-                        buffer = BytesIO()
-                        img.save(buffer, 
-                                 format=visa_photo_compression_algo, 
-                                 quality_mode="rates",                           # JPEG2000 
-                                 quality_layers=[100-visa_photo_avif_quality],   # JPEG2000 
-                                 no_jp2=True,                                    # JPEG2000
-                                 irreversible=True,                              # JPEG2000
-                                 optimize=True,                                  # JPEG
-                                 quality=visa_photo_avif_quality,                # JPEG, AVIF, WEBP
-                                 speed=visa_photo_compression_speed,             # AVIF
-                                 method=visa_photo_compression_speed             # WEBP
-                        )  
-                        visa_photo = buffer.getvalue()
-                        st.caption(f"**Compressed**  \n{img.size} pixels  \n{buffer.tell()} bytes", text_alignment="center")
+                        buffer = BytesIO(visa_photo)
+                        compressed_size = Image.open(buffer).size
+                        st.caption(f"**Compressed**  \n{compressed_size} pixels  \n{len(visa_photo)} bytes", text_alignment="center")
                         with st.container(horizontal_alignment="center"):
                             st.image(buffer)
             except Exception as e:
                 st.error(str(e))
+                visa_photo = None
 
 with col2:
     st.header("Barcode Generation", divider="red")
     try:      
-        data = build({
+        data = build_barcode({
             "flags": {
                 "signed":     signed,
                 "compressed": compressed,
@@ -208,9 +230,10 @@ with col2:
                 }
             }
         }, 
-        sk=signing_key.getvalue() if signing_key else None, 
-        vk=certificate.getvalue() if certificate else None, 
-        includeCert=cert_included)
+        signing_key.getvalue() if signing_key else None, 
+        certificate.getvalue() if certificate else None, 
+        cert_included,
+        date.today())
 
         with st.expander(f"Raw barcode data ({len(data)} bytes)", expanded=False):
             st.write(f"{data.decode()}")
@@ -221,7 +244,7 @@ with col2:
     with st.expander(f"Decoded data (JSON)", expanded=False):
         if data.strip():
             try:
-                parsed = parse(data, vk=certificate.getvalue() if certificate else None)
+                parsed = parse_barcode(data, certificate.getvalue() if certificate else None)
                 st.json(parsed, expanded=True)
             except Exception as e:
                 st.error(str(e))
@@ -238,19 +261,14 @@ with col2:
                     qr_version = st.select_slider("QR Code version", options=["Auto"]+list(range(1, 41)), value="Auto")
                 with sc2:
                     error_correction_levels = ["L (7%)", "M (15%)", "Q (25%)", "H (30%)"]
-                    qr_error_correction = st.select_slider("QR Code error correction level", options=["L (7%)", "M (15%)", "Q (25%)", "H (30%)"], value="M (15%)")
+                    qr_error_correction = st.select_slider("QR Code error correction level", options=error_correction_levels, value="M (15%)")
 
                 if data.strip():
                     try:
-                        qr = QRCode(version=(qr_version if qr_version != "Auto" else None), error_correction=error_correction_levels.index(qr_error_correction), border=0)
-                        qr.add_data(data)
-                        qr.make(fit=False)
-                        img = qr.make_image()
-                        buf = BytesIO()
-                        img.save(buf)
+                        png = render_qr(data, qr_version if qr_version != "Auto" else None, getattr(constants, "ERROR_CORRECT_" + qr_error_correction[0]))
                         
                         with st.container(horizontal_alignment="center"):
-                            st.image(buf.getvalue())
+                            st.image(png)
                     except Exception as e:
                         st.error("Too much data")
                 else:
@@ -265,12 +283,12 @@ with col2:
                     symbol_version_horizontal = st.select_slider("Symbol version (horizontal)", options=["Auto"]+list(range(1, 33)), value="Auto")
                 #jab_multisymbol = st.checkbox("Use multiple symbols", value=False)
 
-                additional_params = []
+                symbol_version = None
                 error = False
                 if (symbol_version_vertical == "Auto" and symbol_version_horizontal == "Auto"):
                     pass
                 elif(symbol_version_vertical != "Auto" and symbol_version_horizontal != "Auto"):
-                    additional_params.extend(["--symbol-version", str(symbol_version_horizontal), str(symbol_version_vertical)])
+                    symbol_version = (symbol_version_horizontal, symbol_version_vertical)
                 else:
                     st.warning("Both symbol versions (horizontal and vertical) must be set to auto or both must be set to a specific version.")
                     error = True
@@ -278,15 +296,10 @@ with col2:
                 if not error:
                     if data.strip():
                         try:
-                            command = ["./bin/jabcodeWriter", "--input", data, "--output", "/dev/stdout", "--color-number", str(jab_colors), "--ecc-level", str(jab_error_correction)] + additional_params
-                            result = subprocess.run(
-                                command,
-                                capture_output=True,
-                                check=True
-                            )
+                            png = jab_renderer().render(data, colors=jab_colors, ecc_level=jab_error_correction, symbol_version=symbol_version)
 
                             with st.container(horizontal_alignment="center"):
-                                st.image(result.stdout)
+                                st.image(png)
                         except Exception as e:
                             st.error("Too much data.")
                     else:
@@ -0,0 +1,128 @@
+"""
+    Opt-in per-stage timing and byte counters for parse(), build() and verify().
+
+    Register a listener with add_listener(); each top level operation then produces a
+    trace, passed to every listener once the operation completes:
+
+        {"operation": "parse", "duration": 0.0012,
+         "stages": {"base32": 0.0001, "zlib": 0.0001, "construct": 0.0009, "c40": 0.0002, ...},
+         "bytes": {"barcode": 612, "compressed": 380, "inflated": 1024, "photo": 700}}
+
+    Stages nest: "construct" (the Construct struct walk) includes the time spent in the
+    C40 and date adapters, which are also reported on their own, and for build() it
+    includes signing, zlib and base32. Only the work of the operation itself is
+    counted: the trial encodings of build(..., optimize="size") are reported as a
+    single "optimize" stage. MetricsRegistry is a ready-made listener that
+    aggregates traces in-process. While no listener is registered, the instrumented
+    code only checks the `enabled` flag.
+"""
+import threading
+from time import perf_counter
+
+enabled = False
+_listeners = []
+_local = threading.local()
+
+def add_listener(listener):
+    global enabled
+    _listeners.append(listener)
+    enabled = True
+
+def remove_listener(listener):
+    global enabled
+    _listeners.remove(listener)
+    enabled = bool(_listeners)
+
+def begin(operation):
+    """ Starts a trace for the current thread, or returns None if one is already active. """
+    if getattr(_local, "trace", None) is not None:
+        return None
+    trace = _local.trace = dict(operation=operation, stages=dict(), bytes=dict(), start=perf_counter())
+    return trace
+
+def end(trace, error=None):
+    if trace is None:
+        return
+    _local.trace = None
+    trace["duration"] = perf_counter() - trace.pop("start")
+    if error is not None:
+        trace["error"] = type(error).__name__
+    for listener in list(_listeners):
+        listener(trace)
+
+def add_time(stage, seconds):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["stages"][stage] = trace["stages"].get(stage, 0.0) + seconds
+
+def add_bytes(name, count):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["bytes"][name] = trace["bytes"].get(name, 0) + count
+
+def timed(stage, func, *args, **kwargs):
+    start = perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        add_time(stage, perf_counter() - start)
+
+def traced(operation, func, *args, **kwargs):
+    """ Runs func inside a trace for `operation`. """
+    trace = begin(operation)
+    error = None
+    try:
+        return func(*args, **kwargs)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        end(trace, error)
+
+def detached(func, *args, **kwargs):
+    """
+        Runs func without recording its stages, byte counts or nested operations in
+        the current trace, e.g. for trial encodings that are not part of the result.
+    """
+    trace = getattr(_local, "trace", None)
+    _local.trace = dict(stages=dict(), bytes=dict())
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.trace = trace
+
+class MetricsRegistry:
+    """
+        Listener aggregating traces: per operation and stage, the number of samples,
+        total and maximum duration, and the totals of the byte counters.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = dict()
+
+    def __call__(self, trace):
+        with self._lock:
+            op = self.operations.setdefault(trace["operation"], dict(count=0, errors=0, stages=dict(), bytes=dict()))
+            op["count"] += 1
+            if "error" in trace:
+                op["errors"] += 1
+            for stage, seconds in [("total", trace["duration"])] + list(trace["stages"].items()):
+                s = op["stages"].setdefault(stage, dict(count=0, total=0.0, max=0.0))
+                s["count"] += 1
+                s["total"] += seconds
+                s["max"] = max(s["max"], seconds)
+            for name, count in trace["bytes"].items():
+                op["bytes"][name] = op["bytes"].get(name, 0) + count
+
+    def snapshot(self):
+        """ Returns a copy of the aggregated metrics, with the mean duration of each stage. """
+        with self._lock:
+            out = dict()
+            for name, op in self.operations.items():
+                stages = { stage: dict(s, mean=s["total"] / s["count"]) for stage, s in op["stages"].items() }
+                out[name] = dict(count=op["count"], errors=op["errors"], stages=stages, bytes=dict(op["bytes"]))
+            return out
@@ -0,0 +1,336 @@
+"""
+    Bulk issuance: applicant records to signed barcodes and rendered QR or JAB Code
+    images.
+
+        python -m idb1.issuance [--secret FILE --public FILE] [--include-cert] [--compressed]
+                                [--algorithm ecdsa_sha256] [--photo-budget BYTES] [--image qr|jab] [--output DIR|FILE.zip]
+                                [--workers N] [--chunksize 64] [--progress] [FILE ...]
+
+    Applicant records hold the fields of the EU visa message (see parser.py) and
+    optionally "country_identifier" (defaults to the issuing member state). They are
+    read as CSV with one column per field ("td_date.issue" style columns for the
+    nested dates) or as JSONL, selected by the file extension or --format. Dates are
+    "YYYY-MM-DD" strings (X for unknown digits), photos hex strings.
+
+    Text fields are normalised (upper case, accents removed, blanks collapsed) and
+    checked against the C40 character set before building, so that a bad record is
+    reported by field name instead of failing inside the encoder. Records are built,
+    signed and rendered on a process pool; one JSON line per record (barcode, image
+    name or error) is written to stdout in input order, images to --output.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+import zipfile
+from io import BytesIO
+from idb1.batch import map_chunks, ItemError
+from idb1.construct_helpers import SIGNING_ALGOS, decode_date, encode_date
+from idb1.parser import Signer, build
+
+C40_FIELDS = ("issuing_member_state", "full_name", "surname_at_birth", "country_of_birth", "place_of_birth",
+              "nationality", "nationality_at_birth", "td_type", "td_issuing_authority", "visa_issuing_authority",
+              "visa_authority_location", "visa_issued_on_behalf", "visa_place_of_decision", "visa_number",
+              "visa_comments")
+DATE_FIELDS = ("date_of_birth", "td_date.issue", "td_date.expiry", "visa_date_of_decision",
+               "visa_date.commencement", "visa_date.expiry")
+FLAG_FIELDS = ("visa_limited_validity", "visa_eueea_family_member", "visa_euuk_family_member")
+MANDATORY_FIELDS = ("issuing_member_state", "full_name", "date_of_birth", "country_of_birth", "sex", "nationality",
+                    "td_type", "td_number", "td_issuing_authority", "td_date.issue", "td_date.expiry",
+                    "visa_issuing_authority", "visa_authority_location", "visa_date_of_decision", "visa_number",
+                    "visa_date.commencement", "visa_date.expiry")
+
+_C40_TEXT = re.compile(r"[ 0-9A-Z]*")
+_ALPHANUMERIC = re.compile(r"[0-9A-Z]*")
+_DATE = re.compile(r"[0-9X]{4}-[0-9X]{2}-[0-9X]{2}")
+_TRUE = ("1", "true", "yes", "y", "x")
+_FALSE = ("", "0", "false", "no", "n")
+
+def _flatten(record, prefix=""):
+    out = dict()
+    for k, v in record.items():
+        if isinstance(v, dict):
+            out.update(_flatten(v, prefix + k + "."))
+        else:
+            out[prefix + k] = v
+    return out
+
+def _text(value):
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return " ".join(value.upper().split())
+
+def _date_round_trips(value):
+    # The date as a barcode decodes it (out of range digits do not fit in 3 bytes)
+    try:
+        return decode_date(encode_date(value)) == value
+    except OverflowError:
+        return False
+
+def normalise_applicant(record):
+    """
+        Returns a copy of an applicant record with flat keys ("td_date.issue"), empty
+        values removed and every field normalised and validated. Raises on the
+        first invalid or missing field.
+    """
+    fields = dict()
+    for name, value in _flatten(record).items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            continue
+
+        if name in C40_FIELDS:
+            value = _text(value)
+            if not _C40_TEXT.fullmatch(value):
+                raise Exception(f"{name}: characters outside the C40 set (A-Z, 0-9 and space)")
+        elif name in DATE_FIELDS:
+            value = value.isoformat() if hasattr(value, "isoformat") else str(value).upper()
+            if not _DATE.fullmatch(value):
+                raise Exception(f"{name}: date expected as YYYY-MM-DD")
+            if not _date_round_trips(value):
+                raise Exception(f"{name}: {value} cannot be encoded")
+        elif name in FLAG_FIELDS:
+            if isinstance(value, str):
+                if value.lower() not in _TRUE + _FALSE:
+                    raise Exception(f"{name}: boolean expected")
+                value = value.lower() in _TRUE
+            value = bool(value)
+        elif name in ("sex", "td_number", "visa_type"):
+            value = _text(value)
+            if not _ALPHANUMERIC.fullmatch(value):
+                raise Exception(f"{name}: alphanumeric characters expected")
+        elif name == "visa_n_of_entries":
+            value = int(value)
+            if not 0 <= value <= 255:
+                raise Exception(f"{name}: value between 0 and 255 expected")
+        elif name == "photo":
+            value = bytes.fromhex(value) if isinstance(value, str) else bytes(value)
+        elif name == "country_identifier":
+            value = _text(value)
+        else:
+            raise Exception(f"Unknown field {name}")
+        fields[name] = value
+
+    for name in MANDATORY_FIELDS:
+        if name not in fields:
+            raise Exception(f"{name}: missing")
+    if len(fields["issuing_member_state"]) != 3:
+        raise Exception("issuing_member_state: 3 letter code expected")
+    if fields["sex"] not in ("M", "F", "X"):
+        raise Exception("sex: M, F or X expected")
+    if len(fields["td_number"]) != 6:
+        raise Exception("td_number: 6 characters expected")
+    if not 1 <= len(fields.get("visa_type", "AA")) <= 4:
+        raise Exception("visa_type: 1 to 4 characters expected")
+    return fields
+
+def make_visa(fields, signed=False, compressed=False, signature_algorithm="ecdsa_sha256"):
+    """ Returns the build() input for an applicant record returned by normalise_applicant(). """
+    eu_visa = dict(visa_limited_validity=False)
+    for name, value in fields.items():
+        if name == "country_identifier":
+            continue
+        if name in ("sex", "td_number", "visa_type"):
+            value = value.encode()
+        if "." in name:
+            parent, name = name.split(".")
+            eu_visa.setdefault(parent, dict())[name] = value
+        else:
+            eu_visa[name] = value
+
+    return {
+        "flags": {
+            "signed":     signed,
+            "compressed": compressed,
+        },
+        "content": {
+            "signable": {
+                "value": {
+                    "header": {
+                        "country_identifier":  fields.get("country_identifier", fields["issuing_member_state"]),
+                        "signature_algorithm": signature_algorithm if signed else None,
+                    },
+                    "message": {
+                        "eu_visa": eu_visa
+                    },
+                },
+            }
+        }
+    }
+
+def render_qr(data, error_correction="M", border=4):
+    from qrcode import QRCode, constants
+    qr = QRCode(error_correction=getattr(constants, "ERROR_CORRECT_" + error_correction), border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    buf = BytesIO()
+    qr.make_image().save(buf)
+    return buf.getvalue()
+
+_issuer = None
+
+def _init_issuer(issuer):
+    global _issuer
+    _issuer = issuer
+
+def _issue_chunk(start, records):
+    signer, options, photo_budget, image, image_options = _issuer
+    renderer = None
+    if image == "jab":
+        from idb1.jabcode import JabRenderer
+        renderer = JabRenderer(workers=1, cache_size=0)
+
+    results = []
+    for index, record in enumerate(records, start):
+        try:
+            fields = normalise_applicant(record)
+            if photo_budget is not None and len(fields.get("photo", b"")) > photo_budget:
+                from idb1.photo import fit_photo
+                fields["photo"] = fit_photo(fields["photo"], photo_budget).data
+            obj = make_visa(fields, signed=signer is not None, **options)
+            barcode = signer.build(obj) if signer is not None else build(obj)
+            png = None
+            if image == "qr":
+                png = render_qr(barcode, **image_options)
+            elif image == "jab":
+                png = renderer.render(barcode, **image_options)
+            results.append((index, obj["content"]["signable"]["value"]["message"]["eu_visa"]["visa_number"], barcode, png))
+        except Exception as e:
+            results.append(ItemError(index, type(e).__name__, str(e)))
+    return results
+
+def issue_many(records, signer=None, compressed=False, signature_algorithm="ecdsa_sha256", photo_budget=None,
+               image=None, image_options=None, workers=None, chunksize=64):
+    """
+        Issues an iterable of applicant records, yielding (index, visa number, barcode,
+        PNG or None) tuples in input order, or an ItemError for records that fail.
+        Records are signed when a Signer is given. Photos larger than `photo_budget`
+        bytes are re-encoded to fit with idb1.photo.fit_photo. `image` is None, "qr" (options:
+        error_correction, border) or "jab" (options: colors, ecc_level, symbol_version).
+        See idb1.batch.map_chunks for `workers`.
+    """
+    if signature_algorithm not in SIGNING_ALGOS:
+        raise Exception(f"Unsupported signature algorithm {signature_algorithm}")
+    if image not in (None, "qr", "jab"):
+        raise Exception(f"Unsupported image type {image}")
+    options = dict(compressed=compressed, signature_algorithm=signature_algorithm)
+    return map_chunks(_issue_chunk, records, workers=workers, chunksize=chunksize, initializer=_init_issuer,
+                      initargs=((signer, options, photo_budget, image, image_options or dict()),))
+
+class ImageWriter:
+    """ Writes images to a directory, or to a zip archive if the path ends with .zip. """
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        if path.lower().endswith(".zip"):
+            # PNGs are already compressed
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, name, data):
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+        else:
+            with open(os.path.join(self.path, name), "wb") as f:
+                f.write(data)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+def read_records(files, format=None):
+    if not files:
+        files = ["-"]
+    for name in files:
+        fmt = format or ("csv" if name.lower().endswith(".csv") else "jsonl")
+        f = sys.stdin if name == "-" else open(name, newline="")
+        try:
+            if fmt == "csv":
+                yield from csv.DictReader(f)
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="idb1-issue", description="Bulk issuance of EU visa barcodes.")
+    parser.add_argument("--secret", type=argparse.FileType("rb"), help="ECDSA signing key (DER), barcodes are unsigned without it")
+    parser.add_argument("--public", type=argparse.FileType("rb"), help="public signer certificate (DER)")
+    parser.add_argument("--include-cert", action="store_true", help="embed the signer certificate in the barcodes")
+    parser.add_argument("--algorithm", choices=list(SIGNING_ALGOS.keys()), default="ecdsa_sha256")
+    parser.add_argument("--compressed", action="store_true", help="zlib compress the barcode content")
+    parser.add_argument("--photo-budget", type=int, help="re-encode photos larger than this many bytes to fit")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="input format (default: from the file extension, jsonl for stdin)")
+    parser.add_argument("--image", choices=["qr", "jab"], help="render the barcodes as QR or JAB Code images")
+    parser.add_argument("--qr-error-correction", choices=list("LMQH"), default="M")
+    parser.add_argument("--jab-colors", type=int, choices=[4, 8], default=8)
+    parser.add_argument("--jab-ecc-level", type=int, default=3)
+    parser.add_argument("--output", help="directory or .zip archive for the images (required with --image)")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=64, help="records handed to a worker at a time (default: 64)")
+    parser.add_argument("--progress", action="store_true", help="report progress on stderr")
+    parser.add_argument("files", nargs="*", metavar="FILE", help="input files (default: stdin)")
+    args = parser.parse_args(argv)
+
+    if args.image and not args.output:
+        parser.error("--image requires --output")
+    signer = None
+    if args.secret:
+        try:
+            signer = Signer(args.secret.read(), args.public.read() if args.public else None, include_cert=args.include_cert)
+        except Exception as e:
+            parser.error(str(e))
+
+    image_options = dict()
+    if args.image == "qr":
+        image_options = dict(error_correction=args.qr_error_correction)
+    elif args.image == "jab":
+        image_options = dict(colors=args.jab_colors, ecc_level=args.jab_ecc_level)
+
+    results = issue_many(read_records(args.files, args.format), signer=signer, compressed=args.compressed,
+                         signature_algorithm=args.algorithm, photo_budget=args.photo_budget, image=args.image, image_options=image_options,
+                         workers=args.workers, chunksize=args.chunksize)
+    writer = ImageWriter(args.output) if args.image else None
+
+    done = failed = 0
+    start = last_report = time.monotonic()
+    out = sys.stdout
+    try:
+        for result in results:
+            done += 1
+            if isinstance(result, ItemError):
+                failed += 1
+                print(f"idb1-issue: record {result.index + 1}: {result.message}", file=sys.stderr)
+                line = dict(index=result.index, error=result.error, message=result.message)
+            else:
+                index, visa_number, barcode, png = result
+                line = dict(index=index, visa_number=visa_number, barcode=barcode.decode())
+                if png is not None:
+                    line["image"] = f"{index + 1:06d}_{visa_number}.png"
+                    writer.write(line["image"], png)
+            out.write(json.dumps(line) + "\n")
+
+            now = time.monotonic()
+            if args.progress and now - last_report >= 1:
+                last_report = now
+                print(f"idb1-issue: {done} records, {failed} failed, {done / (now - start):.0f}/s", file=sys.stderr)
+    finally:
+        if writer is not None:
+            writer.close()
+    out.flush()
+    if args.progress:
+        elapsed = time.monotonic() - start
+        print(f"idb1-issue: done, {done} records, {failed} failed in {elapsed:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
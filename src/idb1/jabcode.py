@@ -0,0 +1,89 @@
+"""
+    JAB Code rendering through the bundled jabcodeWriter binary.
+
+    The writer is a one-shot program: it renders a single symbol per run and has no
+    long-lived or streaming mode, so every distinct render costs one process. The
+    renderer keeps the rendered PNGs in a bounded LRU cache keyed by the payload and
+    the encoding parameters, so repeated renders (e.g. reruns of the generator GUI)
+    do not start a process, and renders batches on a thread pool, the processes
+    running concurrently while the threads wait on them.
+"""
+import os
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+JABCODE_WRITER = os.path.join(os.path.dirname(__file__), "..", "..", "bin", "jabcodeWriter")
+
+class JabRenderer:
+    def __init__(self, executable=JABCODE_WRITER, workers=None, cache_size=256, timeout=30):
+        self.executable = os.path.abspath(executable)
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        self._pool = None
+
+    def _command(self, data, colors, ecc_level, symbol_version):
+        command = [self.executable, "--input", data, "--output", "/dev/stdout",
+                   "--color-number", str(colors), "--ecc-level", str(ecc_level)]
+        if symbol_version is not None:
+            horizontal, vertical = symbol_version
+            command.extend(["--symbol-version", str(horizontal), str(vertical)])
+        return command
+
+    def render(self, data, colors=8, ecc_level=3, symbol_version=None):
+        """
+            Renders `data` (str or ASCII bytes) as a PNG, returned as bytes.
+            `symbol_version` is None (automatic) or a (horizontal, vertical) pair.
+            Raises if the data does not fit or the writer fails.
+        """
+        if isinstance(data, (bytes, bytearray)):
+            data = bytes(data).decode("ascii")
+        key = (data, colors, ecc_level, tuple(symbol_version) if symbol_version is not None else None)
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+                return png
+
+        result = subprocess.run(self._command(*key), capture_output=True, timeout=self.timeout)
+        if result.returncode != 0 or not result.stdout:
+            message = (result.stderr or result.stdout).decode(errors="replace").strip().splitlines()
+            raise Exception(f"JAB Code rendering failed: {message[0] if message else 'exit status ' + str(result.returncode)}")
+
+        png = result.stdout
+        with self._lock:
+            self._cache[key] = png
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return png
+
+    def render_many(self, payloads, colors=8, ecc_level=3, symbol_version=None):
+        """
+            Renders every payload, returns the PNGs in order. Failed renders are
+            returned as the exception instead of a PNG.
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [self._pool.submit(self.render, data, colors, ecc_level, symbol_version) for data in payloads]
+        out = []
+        for future in futures:
+            try:
+                out.append(future.result())
+            except Exception as e:
+                out.append(e)
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
@@ -0,0 +1,80 @@
+"""
+    Size-optimised encoding, used by build(..., optimize="size"). The content of a
+    barcode does not depend on the compressed flag (the signature only covers the
+    header and the message), so a built barcode can be re-encoded uncompressed or
+    with any zlib level, strategy and memory level without signing again. The
+    smallest encoding is kept, after checking that parse() decodes it to the same
+    content. Results are cached for unsigned content, which is deterministic.
+"""
+import zlib
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from idb1.construct_helpers import MAX_INFLATED_SIZE, b32encode_unpadded, decode_payload
+
+STRATEGIES = {
+    "default":      zlib.Z_DEFAULT_STRATEGY,
+    "filtered":     zlib.Z_FILTERED,
+    "huffman_only": zlib.Z_HUFFMAN_ONLY,
+    "rle":          zlib.Z_RLE,
+    "fixed":        zlib.Z_FIXED,
+}
+LEVELS = range(1, 10)
+MEM_LEVELS = (8, 9)
+
+# Encoding parameters of a barcode; level, strategy and mem_level are None if uncompressed
+Variant = namedtuple("Variant", ["compressed", "level", "strategy", "mem_level"])
+SizeReport = namedtuple("SizeReport", ["barcode", "variant", "size", "baseline_size", "saved"])
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+cache_size = 256
+
+def _encode(signed, compressed, payload):
+    return b"NDB1" + bytes([0x41 + signed + 2 * compressed]) + b32encode_unpadded(payload)
+
+def _b32_length(n):
+    return -(-n * 8 // 5)
+
+def _smallest(content):
+    best_variant, best_payload = Variant(False, None, None, None), content
+    for level in LEVELS:
+        for strategy, strategy_value in STRATEGIES.items():
+            for mem_level in MEM_LEVELS:
+                compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, mem_level, strategy_value)
+                payload = compressor.compress(content) + compressor.flush()
+                # Ties go to the variant found first: uncompressed, then lower levels
+                if _b32_length(len(payload)) < _b32_length(len(best_payload)):
+                    best_variant, best_payload = Variant(True, level, strategy, mem_level), payload
+    return best_variant, best_payload
+
+def optimize_size(barcode, max_inflated_size=MAX_INFLATED_SIZE):
+    """
+        Re-encodes a barcode with its smallest encoding, returns a SizeReport.
+        `max_inflated_size` bounds the payload of `barcode` and of the round trip
+        check (see parse()); build() passes None, as it checks content it just built.
+    """
+    from idb1.parser import parse
+    flags, content = decode_payload(barcode, max_inflated_size)
+    signed = flags["signed"]
+
+    cached = None
+    if not signed:
+        with _cache_lock:
+            cached = _cache.get(content)
+            if cached is not None:
+                _cache.move_to_end(content)
+    if cached is not None:
+        variant, optimized = cached
+    else:
+        variant, payload = _smallest(content)
+        optimized = _encode(signed, variant.compressed, payload)
+        if decode_payload(optimized, max_inflated_size) != (flags | dict(compressed=variant.compressed), content):
+            raise Exception("Size optimised barcode does not decode to the original content")
+        parse(optimized, max_inflated_size=max_inflated_size)
+        if not signed:
+            with _cache_lock:
+                _cache[content] = (variant, optimized)
+                while len(_cache) > cache_size:
+                    _cache.popitem(last=False)
+
+    return SizeReport(optimized, variant, len(optimized), len(barcode), len(barcode) - len(optimized))
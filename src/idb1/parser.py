@@ -1,10 +1,16 @@
 from hashlib import sha1
-from ecdsa import SigningKey, VerifyingKey
 from construct import *
 from idb1.construct_helpers import *
+from idb1 import instrumentation
+from idb1.projection import decode_projected, decode_fast, project
 from datetime import datetime
 
-def make_idb1(sk=None, vk=None):
+def make_idb1_content():
+    """
+        The IDB content structure alone, i.e. what is left of a barcode once the magic 
+        number, the flags and the Base32/zlib layers are removed. Parsing it expects
+        the flags as a parameter, e.g. `make_idb1_content().parse(data, flags=flags)`.
+    """
     # IDB Messages
     msg_mrz_td1 =   FocusedSeq("f", Const(b"\x07"), Const(b"\x3c"), "f" / StripLT(C40(Bytes(60))))
     msg_mrz_td3 =   FocusedSeq("f", Const(b"\x08"), Const(b"\x3c"), "f" / StripLT(C40(Bytes(60))))
@@ -69,9 +75,13 @@ def make_idb1(sk=None, vk=None):
         )),
         "signer_certificate"    / Optional(If(this._.flags.signed, FocusedSeq("sc", Const(b"\x7e"), "sc" / Prefixed(DerLengthInt, GreedyBytes)))),
         "signature_data"        / If(this._.flags.signed, FocusedSeq(
-            "sig", Const(b"\x7f"), "sig" / Prefixed(DerLengthInt, Signature(GreedyBytes, this._.signable.data, vk=vk, sk=sk))
+            "sig", Const(b"\x7f"), "sig" / Prefixed(DerLengthInt, Signature(GreedyBytes, this._.signable.data))
         ))
     )
+    return idb1_content
+
+def make_idb1():
+    idb1_content = make_idb1_content()
 
     # IDB1 Outer Structure
     return Struct(
@@ -82,16 +92,90 @@ def make_idb1(sk=None, vk=None):
                         compressed = 2),
         "content" / IfThenElse(
                         this.flags.compressed, 
-                        Base32(Compressed(idb1_content, "zlib", level=9)), 
+                        Base32(Zlib(idb1_content, level=9)), 
                         Base32(idb1_content))
     )
 
-def parse(barcode, vk=None):
+_idb1_schemas = dict()
+
+def get_idb1():
+    """
+        Returns the IDB1 structure, building it only on first use. Keys are not part
+        of the tree (the signing key is passed as a build parameter), so the same
+        instance is shared by every call. The trees are not compiled: compiled
+        Prefixed and Bytes fields do not check for short reads, so truncated barcodes
+        would parse.
+    """
+    schema = _idb1_schemas.get("idb1")
+    if schema is None:
+        schema = _idb1_schemas["idb1"] = make_idb1()
+    return schema
+
+def get_idb1_content():
+    """ 
+        Returns the shared content structure used by parse(), which decodes 
+        the outer layers itself (see decode_payload).
+    """
+    schema = _idb1_schemas.get("content")
+    if schema is None:
+        schema = _idb1_schemas["content"] = make_idb1_content()
+    return schema
+
+def parse(barcode, vk=None, fields=None, max_inflated_size=MAX_INFLATED_SIZE, fast=False, verify=False):
+    """
+        Decodes a barcode into nested dicts. If `fields` is given, only the flags, the 
+        header and the listed fields are decoded (see idb1.projection), falling back
+        to the Construct schema if the projection fails. Compressed 
+        barcodes inflating to more than `max_inflated_size` bytes (None for no limit)
+        are rejected before their content is parsed. With `fast`, the barcode is decoded by the hand-written
+        TLV walker, falling back to the Construct schema if it fails. With `verify`, 
+        the signature is checked against `vk` and barcodes that are not signed or 
+        whose signature is invalid are rejected (projections then include raw_data 
+        and signature_data).
+    """
+    if verify:
+        if vk is None:
+            raise Exception("Signature verification requires a public key")
+        vk = _public_key(vk)
+        if fields is not None:
+            fields = list(fields) + ["raw_data", "signature_data"]
+    if instrumentation.enabled:
+        parsed = instrumentation.traced("parse", _parse_traced, barcode, vk, fields, max_inflated_size, fast)
+    else:
+        parsed = _parse(barcode, vk, fields, max_inflated_size, fast)
+    return _check_signature(parsed, vk) if verify else parsed
+
+def _photo_size(parsed):
+    message = parsed["content"]["signable"]["message"]
+    return len(message.get("photo", b"")) + len(message.get("eu_visa", {}).get("photo", b""))
+
+def _parse_traced(barcode, vk, fields, max_inflated_size, fast):
+    # Photo bytes are counted on the result, whichever path decoded it
+    parsed = _parse(barcode, vk, fields, max_inflated_size, fast)
+    instrumentation.add_bytes("photo", _photo_size(parsed))
+    return parsed
+
+def _parse(barcode, vk, fields, max_inflated_size, fast=False):
     if vk is not None:
+        _public_key(vk)
+
+    flags, content = decode_payload(barcode, max_inflated_size)
+    if fields is not None:
         try:
-            vk = VerifyingKey.from_der(vk)
-        except Exception as e:
-            raise Exception("Invalid ECDSA public key (DER format expected)") from e
+            if instrumentation.enabled:
+                return instrumentation.timed("projection", decode_projected, flags, content, fields)
+            return decode_projected(flags, content, fields)
+        except Exception:
+            # Same as the fast path: the schema decodes the barcode or reports the error
+            pass
+    elif fast:
+        try:
+            if instrumentation.enabled:
+                return instrumentation.timed("fast_path", decode_fast, flags, content)
+            return decode_fast(flags, content)
+        except Exception:
+            # The schema is the reference, let it report the error
+            pass
 
     def clean_json(obj: dict):
         out = dict()
@@ -109,46 +193,177 @@ def parse(barcode, vk=None):
                 if v is not None and v is not False and not k.startswith("_"):
                     out[k] = v
         return out
-    return clean_json(make_idb1(vk=vk).parse(barcode))
+    if instrumentation.enabled:
+        parsed = instrumentation.timed("construct", get_idb1_content().parse, content, flags=flags)
+        out = instrumentation.timed("output", clean_json, dict(flags=flags, content=parsed))
+    else:
+        out = clean_json(dict(flags=flags, content=get_idb1_content().parse(content, flags=flags)))
+    return project(out, fields) if fields is not None else out
+
+def verify(parsed, vk):
+    """
+        Verifies the signature of a barcode returned by parse() against a public key,
+        given as DER bytes, an idb1.crypto.PublicKey or an ecdsa VerifyingKey. Returns
+        True if the signature is valid, False otherwise.
+    """
+    if instrumentation.enabled:
+        return instrumentation.traced("verify", _verify, parsed, vk)
+    return _verify(parsed, vk)
+
+def _public_key(vk):
+    from idb1.crypto import PublicKey, as_public_key
+    if isinstance(vk, PublicKey):
+        return vk
+    try:
+        return as_public_key(vk)
+    except Exception as e:
+        raise Exception("Invalid ECDSA public key (DER format expected)") from e
+
+def _verify(parsed, vk):
+    content = parsed["content"]
+    if "signature_data" not in content:
+        raise Exception("The barcode is not signed")
 
-def build(obj, sk=None, vk=None, includeCert=False):
+    vk = _public_key(vk)
+    hashfunc = SIGNING_ALGOS[content["signable"]["header"]["signature_algorithm"]]
+    if instrumentation.enabled:
+        return instrumentation.timed("ecdsa_verify", vk.verify, content["signature_data"], content["signable"]["raw_data"], hashfunc)
+    return vk.verify(content["signature_data"], content["signable"]["raw_data"], hashfunc)
+
+def _check_signature(parsed, vk):
+    if not verify(parsed, vk):
+        raise Exception("Invalid signature")
+    return parsed
+
+def _reset_signature_fields(obj):
     obj["content"]["signable"]["value"]["header"]["certificate_reference"] = None
     obj["content"]["signable"]["value"]["header"]["signature_creation_date"] = None
     obj["content"]["signer_certificate"] = None
     obj["content"]["signature_data"] = None
 
-    if obj["flags"]["signed"] is True:
-        rawCert = vk
-
+class Signer:
+    """
+        Holds validated key material for signing barcodes: the DER keys are parsed and
+        checked against each other once, and the certificate reference is computed 
+        once, so that build() only pays for the signature itself. Objects without the
+        signed flag are built unsigned. `backend` names the ECDSA backend (see 
+        idb1.crypto), the default one if None.
+    """
+    def __init__(self, sk, vk, include_cert=False, backend=None):
+        from idb1.crypto import get_backend, load_private_key, load_public_key
         if sk is None:
             raise Exception("Unspecified signing key")
         if vk is None:
             raise Exception("Unspecified public signer certificate")
-        
-        if includeCert:
-            obj["content"]["signer_certificate"] = rawCert
 
+        backend = get_backend(backend)
         try:
-            sk = SigningKey.from_der(sk)
+            signing_key = load_private_key(sk, backend)
         except Exception as e:
             raise Exception("Invalid ECDSA signing key (DER format expected)") from e
-        if sk.curve.baselen < 32:
+        if signing_key.key_size < 256:
             raise Exception("Unsupported signing key size (at least 256 bits expected)")
 
         try:
-            vk = VerifyingKey.from_der(vk)
+            verifying_key = load_public_key(vk, backend)
         except Exception as e:
             raise Exception("Invalid ECDSA public certificate (DER format expected)") from e
-        
-        derived_vk = sk.get_verifying_key()
-        if derived_vk.to_string() != vk.to_string():
+
+        if signing_key.point() != verifying_key.point():
             raise Exception("Signing key does not match the provided public certificate")
-    
-        hashfunc = SIGNING_ALGOS[obj["content"]["signable"]["value"]["header"]["signature_algorithm"]]
 
-        sk.default_hashfunc = hashfunc
-        vk.default_hashfunc = hashfunc
+        self.raw_sk = sk
+        self.raw_cert = vk
+        self.include_cert = include_cert
+        self.signing_key = signing_key
+        self.certificate_reference = sha1(vk).digest()[-5:]
+
+    def build(self, obj, optimize=None):
+        """ See build() for `optimize`. """
+        if instrumentation.enabled:
+            return instrumentation.traced("build", self._build, obj, optimize)
+        return self._build(obj, optimize)
+
+    def _build(self, obj, optimize=None):
+        if obj["flags"]["signed"] is not True:
+            return _build_unsigned(obj, optimize)
+
+        _reset_signature_fields(obj)
+        header = obj["content"]["signable"]["value"]["header"]
+        if header["signature_algorithm"] not in SIGNING_ALGOS:
+            raise Exception(f"Unsupported signature algorithm {header['signature_algorithm']}")
+
+        if self.include_cert:
+            obj["content"]["signer_certificate"] = self.raw_cert
+        header["certificate_reference"] = self.certificate_reference
+        header["signature_creation_date"] = int(datetime.now().strftime("%m%d%Y")).to_bytes(4)
+        return _optimize(_build_schema(get_idb1(), obj, sk=self.signing_key, hashfunc=SIGNING_ALGOS[header["signature_algorithm"]]), optimize)
+
+    def build_many(self, objs, workers=None, chunksize=256):
+        """
+            Builds an iterable of objects, yielding barcodes in input order (an ItemError
+            in place of objects that fail). See idb1.batch.map_chunks for `workers`.
+        """
+        from idb1.batch import map_chunks
+        return map_chunks(_build_chunk, objs, workers=workers, chunksize=chunksize, 
+                          initializer=_init_signer, initargs=(self,))
+
+    def __getstate__(self):
+        # Keys are sent to worker processes in DER form and loaded again there
+        return dict(sk=self.raw_sk, vk=self.raw_cert, include_cert=self.include_cert, backend=self.signing_key.backend.name)
+
+    def __setstate__(self, state):
+        self.__init__(state["sk"], state["vk"], state["include_cert"], state.get("backend"))
+
+_signer = None
 
-        obj["content"]["signable"]["value"]["header"]["certificate_reference"] = sha1(rawCert).digest()[-5:]
-        obj["content"]["signable"]["value"]["header"]["signature_creation_date"] = int(datetime.now().strftime("%m%d%Y")).to_bytes(4)
-    return make_idb1(sk=sk, vk=vk).build(obj)
+def _init_signer(signer):
+    global _signer
+    _signer = signer
+    get_idb1()
+
+def _build_chunk(start, objs):
+    from idb1.batch import ItemError
+    results = []
+    for index, obj in enumerate(objs, start):
+        try:
+            results.append(_signer.build(obj))
+        except Exception as e:
+            results.append(ItemError(index, type(e).__name__, str(e)))
+    return results
+
+def _build_schema(schema, obj, **params):
+    if instrumentation.enabled:
+        barcode = instrumentation.timed("construct", schema.build, obj, **params)
+        instrumentation.add_bytes("barcode", len(barcode))
+        return barcode
+    return schema.build(obj, **params)
+
+def _optimize(barcode, optimize):
+    if optimize is None:
+        return barcode
+    if optimize != "size":
+        raise Exception(f"Unsupported optimization {optimize}")
+    from idb1.optimize import optimize_size
+    if instrumentation.enabled:
+        # The trial encodings and their round trip parse are not part of the trace
+        report = instrumentation.timed("optimize", instrumentation.detached, optimize_size, barcode, max_inflated_size=None)
+        instrumentation.add_bytes("saved", report.saved)
+        return report.barcode
+    return optimize_size(barcode, max_inflated_size=None).barcode
+
+def _build_unsigned(obj, optimize=None):
+    _reset_signature_fields(obj)
+    return _optimize(_build_schema(get_idb1(), obj), optimize)
+
+def build(obj, sk=None, vk=None, includeCert=False, optimize=None):
+    """
+        Builds a barcode. With optimize="size" the compressed flag of `obj` is only a
+        starting point: the smallest of the uncompressed and zlib encodings is
+        returned (see idb1.optimize, optimize_size() also reports the variant chosen).
+    """
+    if obj["flags"]["signed"] is True:
+        return Signer(sk, vk, include_cert=includeCert).build(obj, optimize)
+    if instrumentation.enabled:
+        return instrumentation.traced("build", _build_unsigned, obj, optimize)
+    return _build_unsigned(obj, optimize)
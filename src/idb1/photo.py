@@ -0,0 +1,174 @@
+"""
+    Photo encoding to a byte budget. fit_photo() searches the encoding quality, and
+    the scale when the lowest quality does not fit, of every candidate format and
+    returns the encode that fits the budget with the highest PSNR against the source
+    image. Formats are searched in parallel (Pillow releases the GIL while encoding)
+    and every trial encode is memoized by (image digest, format, scale, quality,
+    speed), so repeated searches on the same photo, e.g. GUI reruns, are served from
+    the cache. The cache holds at most cache_max_bytes of encoded data.
+
+    The budget is either given in bytes, or derived from a target barcode size with
+    photo_budget(), e.g. photo_budget(obj, qr_capacity(25, "M"), signer).
+"""
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from io import BytesIO
+from threading import Lock
+from PIL import Image
+
+FORMATS = ("AVIF", "JPEG", "JPEG2000", "WEBP")
+SCALES = (1.0, 0.85, 0.7, 0.55, 0.4, 0.3, 0.2)
+
+# Encoded photo with the parameters that produced it
+Photo = namedtuple("Photo", ["data", "format", "scale", "quality", "speed", "psnr"])
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+_cache_bytes = 0
+# Bound on the total size of the memoized encodes (a trial encode of a large photo
+# at high quality can take megabytes)
+cache_max_bytes = 32 * 1024 * 1024
+
+def image_digest(img):
+    return sha1(img.mode.encode() + repr(img.size).encode() + img.tobytes()).digest()
+
+def _default_speed(format):
+    # Same defaults as the generator GUI
+    return {"AVIF": 6, "WEBP": 2}.get(format)
+
+def _encode(img, format, scale, quality, speed):
+    if scale != 1.0:
+        img = img.resize((max(int(img.width * scale), 1), max(int(img.height * scale), 1)))
+    buffer = BytesIO()
+    img.save(buffer,
+             format=format,
+             quality_mode="rates",            # JPEG2000
+             quality_layers=[100 - quality],  # JPEG2000
+             no_jp2=True,                     # JPEG2000
+             irreversible=True,               # JPEG2000
+             optimize=True,                   # JPEG
+             quality=quality,                 # JPEG, AVIF, WEBP
+             speed=speed,                     # AVIF
+             method=speed                     # WEBP
+    )
+    return buffer.getvalue()
+
+def encode(img, format, scale=1.0, quality=20, speed=None, digest=None):
+    """ Encodes `img` like the generator GUI does, memoized. Pass `digest` to skip hashing the image. """
+    if speed is None:
+        speed = _default_speed(format)
+    key = (digest or image_digest(img), format, scale, quality, speed)
+    with _cache_lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+            return data
+    global _cache_bytes
+    data = _encode(img, format, scale, quality, speed)
+    if len(data) > cache_max_bytes:
+        return data
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = data
+            _cache_bytes += len(data)
+            while _cache_bytes > cache_max_bytes:
+                _, evicted = _cache.popitem(last=False)
+                _cache_bytes -= len(evicted)
+    return data
+
+def psnr(reference, data):
+    """ PSNR in dB of the encoded image `data` against `reference` (a float array of the source). """
+    import numpy as np
+    with Image.open(BytesIO(data)) as decoded:
+        mode = "L" if reference.ndim == 2 else "RGB"
+        decoded = decoded.convert(mode).resize((reference.shape[1], reference.shape[0]), Image.BICUBIC)
+        mse = np.mean((np.asarray(decoded, dtype=np.float32) - reference) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+def _search(img, digest, format, max_bytes, speed, min_quality, max_quality, scales):
+    """ Largest quality fitting the budget at each scale, stopping at the first scale reaching max_quality. """
+    found = []
+    for scale in scales:
+        if len(encode(img, format, scale, min_quality, speed, digest)) > max_bytes:
+            continue
+        low, high = min_quality, max_quality
+        while low < high:
+            mid = (low + high + 1) // 2
+            if len(encode(img, format, scale, mid, speed, digest)) <= max_bytes:
+                low = mid
+            else:
+                high = mid - 1
+        found.append((scale, low, encode(img, format, scale, low, speed, digest)))
+        if low == max_quality:
+            break
+    return found
+
+def fit_photo(image, max_bytes, formats=FORMATS, grayscale=False, speed=None,
+              min_quality=1, max_quality=90, scales=SCALES, workers=None):
+    """
+        Returns the Photo that fits in `max_bytes` with the highest PSNR, searching
+        every format in `formats` over `scales` and qualities. `image` is a PIL image,
+        a path or encoded bytes. Raises if nothing fits, even at the smallest scale.
+    """
+    import numpy as np
+    if isinstance(image, (bytes, bytearray)):
+        image = BytesIO(image)
+    img = image if isinstance(image, Image.Image) else Image.open(image)
+    img = img.convert("L" if grayscale else "RGB")
+    digest = image_digest(img)
+    reference = np.asarray(img, dtype=np.float32)
+
+    def search(format):
+        format_speed = speed if speed is not None else _default_speed(format)
+        found = _search(img, digest, format, max_bytes, format_speed, min_quality, max_quality, scales)
+        return [(format, scale, quality, format_speed, data) for scale, quality, data in found]
+
+    with ThreadPoolExecutor(max_workers=workers or min(len(formats), os.cpu_count() or 1)) as executor:
+        candidates = [c for found in executor.map(search, formats) for c in found]
+    if not candidates:
+        raise Exception(f"The photo does not fit in {max_bytes} bytes")
+
+    best = None
+    for format, scale, quality, format_speed, data in candidates:
+        score = psnr(reference, data)
+        if best is None or score > best.psnr:
+            best = Photo(data, format, scale, quality, format_speed, score)
+    return best
+
+def qr_capacity(version, error_correction="M"):
+    """ Number of barcode characters (QR alphanumeric mode) a QR code of `version` holds. """
+    from qrcode import constants, util
+    bits = util.BIT_LIMIT_TABLE[getattr(constants, "ERROR_CORRECT_" + error_correction)][version]
+    bits -= 4 + (9 if version < 10 else 11 if version < 27 else 13)
+    return 2 * (bits // 11) + (1 if bits % 11 >= 6 else 0)
+
+def photo_budget(obj, max_chars, signer=None):
+    """
+        Largest photo, in bytes, that keeps the barcode built from `obj` (with its photo
+        replaced) within `max_chars` characters. Measured with incompressible data as
+        photos are, leaving room for the variable length of ECDSA signatures.
+    """
+    from idb1.parser import build
+    eu_visa = obj["content"]["signable"]["value"]["message"]["eu_visa"]
+    original = eu_visa.get("photo")
+    slack = 4 if obj["flags"]["signed"] else 0
+
+    def size(n):
+        eu_visa["photo"] = os.urandom(n) if n else None
+        return len(signer.build(obj) if signer is not None else build(obj)) + slack
+
+    try:
+        if size(0) > max_chars:
+            return 0
+        low, high = 0, max_chars
+        while low < high:
+            mid = (low + high + 1) // 2
+            if size(mid) <= max_chars:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+    finally:
+        eu_visa["photo"] = original
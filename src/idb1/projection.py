@@ -0,0 +1,270 @@
+"""
+    Field-projected decoding: walks the TLVs of a barcode once, decoding only the
+    requested fields and skipping the others by their DER length, without running
+    the C40 or date decoders on them. The result has the same shape as the output
+    of parse(), restricted to the flags, the header and the requested fields. The
+    photos requested are returned as memoryviews into the decoded payload instead of
+    copies. They are sliced during the walk, not on access, and each one keeps the
+    whole decoded payload alive: copy it with bytes() to keep a photo longer than
+    the rest of the result.
+
+    Fields are selected by name: "mrz_td1", "mrz_td3", "can", "photo", "eu_visa"
+    (every EU visa field) or "eu_visa.<field>", plus "raw_data", "signer_certificate"
+    and "signature_data". Mandatory EU visa fields are only checked for presence
+    when at least one EU visa field is requested.
+
+    parse_fast() runs the same walk over every field, as a fast path for parse().
+    Its output is identical to that of the Construct schema, which remains the
+    reference: on any error parse() falls back to the schema, so that errors are
+    reported by Construct (see benchmarks/fast_parse_diff.py for the differential
+    check of both decoders). Projections fall back the same way, the schema output
+    being restricted to the requested fields by project(), so parse(fields=...)
+    accepts every barcode that parse() accepts. The converse does not hold: as the
+    fields that are not requested are not decoded, a projection can succeed, or
+    return a field, where the schema rejects the barcode or stops at an earlier
+    invalid optional field.
+"""
+from construct import EnumIntegerString, EnumInteger
+from idb1.construct_helpers import SIGNING_ALGOS, MAX_INFLATED_SIZE, c40_decode, decode_date, decode_payload
+
+_ALGORITHM_NAMES = dict(enumerate(SIGNING_ALGOS.keys()))
+
+def _c40(v):
+    return c40_decode(v)
+
+def _mrz(v):
+    return c40_decode(v).replace(" ", "<")
+
+def _bytes(v):
+    return bytes(v)
+
+def _view(v):
+    return v
+
+def _flag(v):
+    return v[0] != 0
+
+def _byte(v):
+    return v[0]
+
+def _date_pair(first, second):
+    return lambda v: {first: decode_date(v[0:4]), second: decode_date(v[4:8])}
+
+# tag: (name, fixed length or None if DER length prefixed, decoder, mandatory)
+EU_VISA_TAGS = {
+    0x01: ("issuing_member_state",     2,    _c40,                                 True),
+    0x02: ("full_name",                None, _c40,                                 True),
+    0x03: ("surname_at_birth",         None, _c40,                                 False),
+    0x04: ("date_of_birth",            4,    decode_date,                          True),
+    0x05: ("country_of_birth",         None, _c40,                                 True),
+    0x06: ("place_of_birth",           None, _c40,                                 False),
+    0x07: ("sex",                      1,    _bytes,                               True),
+    0x08: ("nationality",              None, _c40,                                 True),
+    0x09: ("nationality_at_birth",     None, _c40,                                 False),
+    0x0A: ("td_type",                  None, _c40,                                 True),
+    0x0B: ("td_number",                6,    _bytes,                               True),
+    0x0C: ("td_issuing_authority",     None, _c40,                                 True),
+    0x0D: ("td_date",                  8,    _date_pair("issue", "expiry"),        True),
+    0x0E: ("visa_issuing_authority",   None, _c40,                                 True),
+    0x0F: ("visa_authority_location",  None, _c40,                                 True),
+    0x10: ("visa_issued_on_behalf",    None, _c40,                                 False),
+    0x11: ("visa_place_of_decision",   None, _c40,                                 False),
+    0x12: ("visa_date_of_decision",    4,    decode_date,                          True),
+    0x13: ("visa_type",                None, _bytes,                               False),
+    0x14: ("visa_limited_validity",    1,    _flag,                                True),
+    0x15: ("visa_number",              None, _c40,                                 True),
+    0x17: ("visa_date",                8,    _date_pair("commencement", "expiry"), True),
+    0x18: ("visa_n_of_entries",        1,    _byte,                                False),
+    0x1A: ("visa_eueea_family_member", 1,    _flag,                                False),
+    0x1B: ("visa_euuk_family_member",  1,    _flag,                                False),
+    0x1C: ("visa_comments",            None, _c40,                                 False),
+    0x1D: ("photo",                    None, _view,                                False),
+}
+EU_VISA_FIELDS = [name for name, _, _, _ in EU_VISA_TAGS.values()]
+
+# tag: (name, constant second byte or None, fixed length or None if DER length prefixed, decoder)
+MESSAGE_TAGS = {
+    0x07: ("mrz_td1", 0x3C, 60,   _mrz),
+    0x08: ("mrz_td3", 0x3C, 60,   _mrz),
+    0x09: ("can",     0x04, 4,    _c40),
+    0x1B: ("photo",   None, None, _view),
+}
+EU_VISA_TAG = 0x1C
+
+OTHER_FIELDS = ("raw_data", "signer_certificate", "signature_data")
+ALL_FIELDS = ("mrz_td1", "mrz_td3", "can", "photo") + OTHER_FIELDS
+
+def der_length(buf, pos):
+    """ Reads a DER length at `pos`, returns (length, position after the length). """
+    b = buf[pos]
+    pos += 1
+    if b >= 0b10000000:
+        num_bytes = b & 0b01111111
+        if pos + num_bytes > len(buf):
+            raise Exception(f"Truncated barcode: expected {num_bytes} length bytes at offset {pos}")
+        return int.from_bytes(buf[pos:pos + num_bytes], "big"), pos + num_bytes
+    return b, pos
+
+def _read(buf, pos, length):
+    end = pos + length
+    if end > len(buf):
+        raise Exception(f"Truncated barcode: expected {length} bytes at offset {pos}")
+    return buf[pos:end], end
+
+def _expect(buf, pos, value, what):
+    if pos >= len(buf) or buf[pos] != value:
+        raise Exception(f"Malformed barcode: expected {what} ({value:#04x}) at offset {pos}")
+    return pos + 1
+
+def _select(fields):
+    top = set()
+    eu_visa = set()
+    for field in fields:
+        if field == "eu_visa":
+            eu_visa.update(EU_VISA_FIELDS)
+        elif field.startswith("eu_visa."):
+            name = field[len("eu_visa."):]
+            if name not in EU_VISA_FIELDS:
+                raise Exception(f"Unknown EU visa field {name}")
+            eu_visa.add(name)
+        elif field in OTHER_FIELDS or field in ("mrz_td1", "mrz_td3", "can", "photo"):
+            top.add(field)
+        else:
+            raise Exception(f"Unknown field {field}")
+    return top, eu_visa
+
+def _parse_eu_visa(buf, pos, end, wanted, photo):
+    out = dict()
+    seen = set()
+    last = 0
+    while pos < end:
+        tag = buf[pos]
+        entry = EU_VISA_TAGS.get(tag)
+        if entry is None or tag <= last:
+            # Like the Construct schema, ignore whatever follows the known fields
+            break
+        name, length, decoder, _ = entry
+        pos += 1
+        if length is None:
+            length, pos = der_length(buf, pos)
+        value, pos = _read(buf, pos, length)
+        if pos > end:
+            raise Exception("Malformed barcode: EU visa field exceeds the message length")
+        if name in wanted:
+            value = photo(value) if name == "photo" else decoder(value)
+            if value is not None and value is not False:
+                out[name] = value
+        seen.add(tag)
+        last = tag
+
+    for tag, (name, _, _, mandatory) in EU_VISA_TAGS.items():
+        if mandatory and tag not in seen:
+            raise Exception(f"Malformed barcode: missing mandatory EU visa field {name}")
+    return out
+
+def parse_projected(barcode, fields, max_inflated_size=MAX_INFLATED_SIZE):
+    top, eu_visa_fields = _select(fields)
+    flags, content = decode_payload(barcode, max_inflated_size)
+    return _walk(flags, content, top, eu_visa_fields, _view)
+
+def decode_projected(flags, content, fields):
+    """ Same as parse_projected(), for the flags and content returned by decode_payload(). """
+    top, eu_visa_fields = _select(fields)
+    return _walk(flags, content, top, eu_visa_fields, _view)
+
+def project(parsed, fields):
+    """ Restricts a parse() result to `fields`, with the shape of parse_projected() output. """
+    top, eu_visa_fields = _select(fields)
+    content = parsed["content"]
+    signable = content["signable"]
+    message = { k: v for k, v in signable["message"].items() if k in top }
+    if eu_visa_fields:
+        message["eu_visa"] = { k: v for k, v in signable["message"]["eu_visa"].items() if k in eu_visa_fields }
+    out_signable = dict(header=signable["header"], message=message)
+    if "raw_data" in top:
+        out_signable["raw_data"] = signable["raw_data"]
+    out_content = dict(signable=out_signable)
+    for name in ("signer_certificate", "signature_data"):
+        if name in top and name in content:
+            out_content[name] = content[name]
+    return dict(flags=parsed["flags"], content=out_content)
+
+def parse_fast(barcode, max_inflated_size=MAX_INFLATED_SIZE):
+    """ Decodes every field, with the same output as the Construct schema. """
+    flags, content = decode_payload(barcode, max_inflated_size)
+    return decode_fast(flags, content)
+
+def decode_fast(flags, content):
+    """ Same as parse_fast(), for the flags and content returned by decode_payload(). """
+    return _walk(flags, content, ALL_FIELDS, EU_VISA_FIELDS, _bytes)
+
+def _walk(flags, content, top, eu_visa_fields, photo):
+    buf = memoryview(content)
+
+    # Header
+    header = dict()
+    value, pos = _read(buf, 0, 2)
+    header["country_identifier"] = c40_decode(value)
+    if flags["signed"]:
+        value, pos = _read(buf, pos, 10)
+        algorithm = value[0]
+        header["signature_algorithm"] = (EnumIntegerString.new(algorithm, _ALGORITHM_NAMES[algorithm])
+                                         if algorithm in _ALGORITHM_NAMES else EnumInteger(algorithm))
+        header["certificate_reference"] = bytes(value[1:6])
+        header["signature_creation_date"] = decode_date(value[6:10])
+
+    # Message
+    pos = _expect(buf, pos, 0x61, "message start")
+    length, pos = der_length(buf, pos)
+    message_end = pos + length
+    if message_end > len(buf):
+        raise Exception("Truncated barcode: message exceeds the payload length")
+
+    message = dict()
+    last = 0
+    while pos < message_end:
+        tag = buf[pos]
+        pos += 1
+        if tag == EU_VISA_TAG:
+            length, pos = der_length(buf, pos)
+            if pos + length > message_end:
+                raise Exception("Truncated barcode: EU visa message exceeds the message length")
+            if eu_visa_fields:
+                message["eu_visa"] = _parse_eu_visa(buf, pos, pos + length, eu_visa_fields, photo)
+            pos += length
+            break
+        entry = MESSAGE_TAGS.get(tag)
+        if entry is None or tag <= last:
+            raise Exception(f"Malformed barcode: unexpected message tag {tag:#04x}")
+        name, const, length, decoder = entry
+        if const is not None:
+            pos = _expect(buf, pos, const, name + " length")
+        if length is None:
+            length, pos = der_length(buf, pos)
+        value, pos = _read(buf, pos, length)
+        if name in top:
+            message[name] = photo(value) if name == "photo" else decoder(value)
+        last = tag
+    else:
+        raise Exception("Malformed barcode: missing EU visa message")
+
+    signable = dict(header=header, message=message)
+    if "raw_data" in top:
+        signable["raw_data"] = bytes(buf[0:message_end])
+    out_content = dict(signable=signable)
+
+    # Signer certificate and signature
+    pos = message_end
+    if flags["signed"]:
+        if pos < len(buf) and buf[pos] == 0x7E:
+            length, pos = der_length(buf, pos + 1)
+            value, pos = _read(buf, pos, length)
+            if "signer_certificate" in top:
+                out_content["signer_certificate"] = bytes(value)
+        pos = _expect(buf, pos, 0x7F, "signature")
+        length, pos = der_length(buf, pos)
+        value, pos = _read(buf, pos, length)
+        if "signature_data" in top:
+            out_content["signature_data"] = bytes(value)
+
+    return dict(flags={ k: v for k, v in flags.items() if v }, content=out_content)
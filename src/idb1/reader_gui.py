@@ -1,13 +1,10 @@
-from idb1.parser import parse
+from idb1.parser import parse, verify
 import streamlit as st
-from hashlib import sha256, sha384, sha512
-import cv2
-import numpy as np
-from PIL import Image, ImageOps
-from ecdsa import VerifyingKey
-import pandas as pd
 
-SIGNING_ALGOS = dict(ecdsa_sha256=sha256, ecdsa_sha384=sha384, ecdsa_sha512=sha512)
+@st.cache_resource(max_entries=8)
+def load_trust_store(certificates):
+    from idb1.trust import TrustStore
+    return TrustStore(certificates)
 
 st.set_page_config(layout="centered", page_title="Barcode Reader Demo", page_icon="🤳🏻")
 st.title("✨ IDB Barcode Reader 🤳🏻", text_alignment="center")
@@ -16,28 +13,36 @@ sc1, sc2 = st.columns(2)
 with sc1:
     barcode = st.file_uploader("Upload Barcode Image", type=["png", "jpg", "jpeg"], accept_multiple_files=False)
 with sc2:
-    certificate = st.file_uploader("Upload Signer Certificate (DER format)", type=["der"], accept_multiple_files=False)
+    certificates = st.file_uploader("Upload Signer Certificates (DER format)", type=["der"], accept_multiple_files=True)
 
 if barcode is None:
     st.info("Load a barcode image")
     st.stop()
 
+# Image reading and the tables are only needed once an image is uploaded
+from idb1.scan import load_gray, detect
+import pandas as pd
+
+trust_store = None
+if certificates:
+    try:
+        trust_store = load_trust_store(tuple(c.getvalue() for c in certificates))
+    except Exception as e:
+        st.error("❌ Invalid certificate: The certificates you uploaded must be valid DER-encoded ECDSA certificates.")
+
 # Load image and convert image
 try:
-    image = Image.open(barcode).convert("RGB")
-    image = ImageOps.expand(image, border=30, fill="white")
-    image = np.array(image)[:, :, ::-1].copy()
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    image, _, _, _ = load_gray(barcode.getvalue())
 except Exception as e:
     st.error("Failed to load the image. Please make sure it's a valid image file.")
     st.stop()
     
 # Detect and read QR Code
-detector = cv2.QRCodeDetector()
-data, points, _ = detector.detectAndDecode(image)
-if points is None:
+codes = detect(image)
+if not codes:
     st.error("No barcode detected in the uploaded image.")
     st.stop()
+data = next((d for d, _ in codes if d), "")
 
 # Decode barcode content
 try:
@@ -101,7 +106,7 @@ with sc2:
     if b_euvisa_photo:
         st.image(b_euvisa_photo)
     if b_signed:
-        if certificate is None and b_signer_certificate is None:
+        if trust_store is None and b_signer_certificate is None:
             st.warning("⚠️ The barcode is signed but there is no certifica (neither uploaded nor embedded in the barcode) to verify the signature against.")
         else:
             if b_signature_data is None:
@@ -109,24 +114,19 @@ with sc2:
             else:
                 if b_signer_certificate:
                     try:
-                        vk = VerifyingKey.from_der(b_signer_certificate)
-                        try:
-                            vk.verify(b_signature_data, b_raw_data, hashfunc=SIGNING_ALGOS[b_signature_algorithm])
+                        if verify(parsed, b_signer_certificate):
                             st.success("✅ Valid signature (verified with barcode embedded certificate).")
-                        except Exception as e:
+                        else:
                             st.error(f"❌ Signature verification failed (verified with barcode embedded certificate).")
                     except:
                         st.error("❌ Invalid certificate: The certificate embedded in the barcode is not a valid DER-encoded ECDSA certificate.")
-                if certificate:
-                    try:
-                        vk = VerifyingKey.from_der(certificate.getvalue())
-                        try:
-                            vk.verify(b_signature_data, b_raw_data, hashfunc=SIGNING_ALGOS[b_signature_algorithm])
-                            st.success("✅ Valid signature (verified with uploaded certificate).")
-                        except Exception as e:
-                            st.error("❌ Signature verification failed (verified with uploaded certificate).")
-                    except Exception as e:
-                        st.error("❌ Invalid certificate: The certificate you uploaded is not a valid DER-encoded ECDSA certificate.")
+                if trust_store is not None:
+                    if trust_store.key_for(parsed) is None:
+                        st.error("❌ None of the uploaded certificates matches the certificate reference of the barcode.")
+                    elif trust_store.verify(parsed):
+                        st.success("✅ Valid signature (verified with uploaded certificate).")
+                    else:
+                        st.error("❌ Signature verification failed (verified with uploaded certificate).")
                 else:
                     st.info("ℹ️ Upload a trusted certificate for a secure signature certification.")
     else:
@@ -0,0 +1,67 @@
+"""
+    Conversion between the output of parse() and JSON-serialisable records, and from
+    such records back to the input expected by build(). Records keep the shape of
+    the parse() output; bytes values are written as hex strings, except for the
+    short alphanumeric fields listed in TEXT_FIELDS, which are written as text.
+"""
+
+TEXT_FIELDS = ("sex", "td_number", "visa_type")
+
+def to_record(obj):
+    if isinstance(obj, dict):
+        return { k: (v.decode() if k in TEXT_FIELDS and isinstance(v, bytes) else to_record(v)) for k, v in obj.items() }
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).hex()
+    if isinstance(obj, str):
+        # Enum values are str subclasses, JSON only needs the plain string
+        return str(obj)
+    return obj
+
+def from_record(record):
+    """
+        Returns a build() input object for a record with the same shape as the parse()
+        output (e.g. as produced by to_record()). Dates may be given either as
+        "YYYY-MM-DD" strings or as bytes. Absent flags and optional fields default to
+        False/None, fields that are only produced by signing are ignored.
+    """
+    flags = record.get("flags", {})
+    signable = record["content"]["signable"]
+    header = signable["header"]
+    message = signable["message"]
+
+    def from_fields(fields):
+        out = dict()
+        for k, v in fields.items():
+            if isinstance(v, dict):
+                out[k] = from_fields(v)
+            elif isinstance(v, str) and k in TEXT_FIELDS:
+                out[k] = v.encode()
+            elif isinstance(v, str) and k == "photo":
+                out[k] = bytes.fromhex(v)
+            else:
+                out[k] = v
+        return out
+
+    eu_visa = from_fields(message["eu_visa"])
+    eu_visa.setdefault("visa_limited_validity", False)
+
+    msg = from_fields({ k: v for k, v in message.items() if k != "eu_visa" })
+    msg["eu_visa"] = eu_visa
+
+    return {
+        "flags": {
+            "signed":     bool(flags.get("signed", False)),
+            "compressed": bool(flags.get("compressed", False)),
+        },
+        "content": {
+            "signable": {
+                "value": {
+                    "header": {
+                        "country_identifier":  header["country_identifier"],
+                        "signature_algorithm": header.get("signature_algorithm"),
+                    },
+                    "message": msg,
+                },
+            }
+        }
+    }
@@ -0,0 +1,187 @@
+"""
+    Headless barcode image reader for folders of scans:
+
+        python -m idb1.scan [--public FILE] [--trust-dir DIR] [--workers N] [--processes]
+                            [--max-side 1600] PATH [PATH ...]
+
+    Every image (directories are searched recursively) yields one JSON line on
+    stdout, in input order:
+
+        {"image": "gate1/0001.jpg", "width": 4000, "height": 3000, "scale": 0.4,
+         "codes": [{"points": [[x, y], ...], "data": "NDB1...", "record": {...}, "signature": "valid"}],
+         "timing": {"load": 0.031, "detect": 0.042, "parse": 0.001, "total": 0.074}}
+
+    Images are read straight to grayscale, downscaled so that their longest side is
+    at most --max-side pixels and padded with a white quiet zone; all codes in the
+    frame are read with detectAndDecodeMulti and parsed. Code corners are reported
+    in the coordinates of the original image. Detectors are reused per thread;
+    OpenCV releases the GIL while detecting, so a thread pool (the default) keeps
+    every core busy, --processes uses a process pool instead.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import cv2
+import numpy as np
+from idb1.batch import map_chunks
+from idb1.parser import parse
+from idb1.records import to_record
+from idb1.trust import TrustStore
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+BORDER = 30
+
+_local = threading.local()
+_trust_store = None
+
+def _detector():
+    detector = getattr(_local, "detector", None)
+    if detector is None:
+        detector = _local.detector = cv2.QRCodeDetector()
+    return detector
+
+def iter_images(paths):
+    """ Yields the image files among `paths`, searching directories recursively in name order. """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def load_gray(image, max_side=1600):
+    """
+        Reads an image (path or encoded bytes) as grayscale, downscaled so that its
+        longest side is at most `max_side` pixels and padded with a white border.
+        Returns (image, original width, original height, scale).
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        gray = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+    else:
+        gray = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise Exception("Unreadable image")
+
+    height, width = gray.shape
+    scale = 1.0
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        gray = cv2.resize(gray, (max(round(width * scale), 1), max(round(height * scale), 1)), interpolation=cv2.INTER_AREA)
+    gray = cv2.copyMakeBorder(gray, BORDER, BORDER, BORDER, BORDER, cv2.BORDER_CONSTANT, value=255)
+    return gray, width, height, scale
+
+def detect(gray):
+    """ Returns a list of (data, corners) for the codes found; data is "" if a code could not be decoded. """
+    detector = _detector()
+    found, decoded, points, _ = detector.detectAndDecodeMulti(gray)
+    if found and points is not None:
+        return list(zip(decoded, points))
+    # The multi detector occasionally misses frames holding a single code
+    data, points, _ = detector.detectAndDecode(gray)
+    if points is not None:
+        return [(data, points.reshape(-1, 2))]
+    return []
+
+def scan_image(image, name=None, trust_store=None, max_side=1600):
+    """ Reads and parses every code in an image, returns the record described above. """
+    start = perf_counter()
+    record = dict(image=name if name is not None else (image if isinstance(image, str) else None), codes=[])
+    timing = record["timing"] = dict(load=0.0, detect=0.0, parse=0.0)
+    try:
+        gray, record["width"], record["height"], scale = load_gray(image, max_side)
+        record["scale"] = scale
+        t = perf_counter()
+        timing["load"] = t - start
+
+        codes = detect(gray)
+        timing["detect"] = perf_counter() - t
+
+        t = perf_counter()
+        for data, corners in codes:
+            code = dict(points=((np.asarray(corners, dtype=np.float64) - BORDER) / scale).round(1).tolist())
+            record["codes"].append(code)
+            if not data:
+                code["error"] = "Undecodable code"
+                continue
+            code["data"] = data
+            try:
+                parsed = parse(data.encode())
+                code["record"] = to_record(parsed)
+                if trust_store is not None:
+                    code["signature"] = trust_store.signature_status(parsed)
+            except Exception as e:
+                code["error"] = str(e)
+        timing["parse"] = perf_counter() - t
+    except Exception as e:
+        record["error"] = str(e)
+    timing["total"] = perf_counter() - start
+    return record
+
+def _init_scanner(trust_store):
+    global _trust_store
+    _trust_store = trust_store
+
+def _scan_chunk(start, images, max_side):
+    return [scan_image(image, trust_store=_trust_store, max_side=max_side) for image in images]
+
+def scan_many(images, trust_store=None, max_side=1600, workers=None, processes=False, chunksize=16):
+    """
+        Scans an iterable of images (paths or encoded bytes), yielding records in
+        input order. Threads are used unless `processes` is set; either way at most
+        two images (chunks with processes) per worker are in flight.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if processes:
+        yield from map_chunks(_scan_chunk, images, workers=workers, chunksize=chunksize,
+                              initializer=_init_scanner, initargs=(trust_store,), args=(max_side,))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for image in images:
+            pending.append(executor.submit(scan_image, image, trust_store=trust_store, max_side=max_side))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="idb1-scan", description="Reads and decodes the barcodes in image files.")
+    parser.add_argument("--public", type=argparse.FileType("rb"), help="trusted signer certificate (DER)")
+    parser.add_argument("--trust-dir", help="directory of trusted signer certificates (*.der)")
+    parser.add_argument("--workers", type=int, help="number of worker threads or processes (default: number of CPUs)")
+    parser.add_argument("--processes", action="store_true", help="use worker processes instead of threads")
+    parser.add_argument("--max-side", type=int, default=1600, help="downscale images to this size before detection (default: 1600, 0 to disable)")
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="image files or directories")
+    args = parser.parse_args(argv)
+
+    trust_store = None
+    if args.public or args.trust_dir:
+        try:
+            trust_store = TrustStore.from_directory(args.trust_dir) if args.trust_dir else TrustStore()
+            if args.public:
+                trust_store.add(args.public.read())
+        except Exception as e:
+            parser.error(str(e))
+
+    failed = False
+    out = sys.stdout
+    for record in scan_many(iter_images(args.paths), trust_store=trust_store, max_side=args.max_side,
+                            workers=args.workers, processes=args.processes):
+        if "error" in record or not record["codes"] or any("error" in code for code in record["codes"]):
+            failed = True
+        out.write(json.dumps(record) + "\n")
+    out.flush()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
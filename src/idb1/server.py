@@ -0,0 +1,198 @@
+"""
+    Barcode decoding service over a line protocol:
+
+        python -m idb1.server [--host 127.0.0.1] [--port 8765] [--public FILE] [--trust-dir DIR]
+                              [--workers N] [--processes] [--max-pending 256] [--pipeline 32]
+                              [--timeout 5] [--fast] [--cache-size N] [--cache-ttl 60]
+
+    Clients send one barcode per line and receive one JSON line per barcode, in
+    request order on each connection: the record of idb1.cli `dec` (with a
+    "signature" status when certificates are given), or {"error": ..., "message": ...}.
+
+    Decoding (zlib inflation, the schema walk and ECDSA verification) runs on a
+    bounded executor, threads by default or processes with --processes. At most
+    --max-pending requests are in flight over all connections and --pipeline per
+    connection; beyond that the server stops reading, so clients are slowed down by
+    TCP flow control instead of queueing unbounded work. Requests taking longer than
+    --timeout seconds are answered with a Timeout error; their job keeps its place
+    in --max-pending until it ends, as executor jobs cannot be interrupted.
+
+    With --cache-size, responses are cached by barcode digest for --cache-ttl
+    seconds (see idb1.cache), so that a barcode read again within that time skips
+    decoding and signature verification. Each worker process has its own cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from idb1.cache import ParseCache, barcode_digest
+from idb1.parser import parse
+from idb1.records import to_record
+
+MAX_LINE = 64 * 1024
+
+_trust_store = None
+_cache = None
+
+def _init_worker(trust_store, cache=None):
+    global _trust_store, _cache
+    _trust_store = trust_store
+    _cache = cache
+
+def _decode_in_worker(barcode, fast=False):
+    # Worker processes belong to a single server, which set them up with _init_worker
+    return decode(barcode, fast, _trust_store, _cache)
+
+def decode(barcode, fast=False, trust_store=None, cache=None):
+    """ Returns the response for one barcode; runs on the executor. """
+    try:
+        if cache is not None:
+            # Errors are raised through the cache, which does not keep them
+            return cache.lookup(barcode_digest(barcode), lambda: _decode(barcode, fast, trust_store))
+        return _decode(barcode, fast, trust_store)
+    except Exception as e:
+        return dict(error=type(e).__name__, message=str(e))
+
+def _decode(barcode, fast, trust_store):
+    parsed = parse(barcode, fast=fast)
+    record = to_record(parsed)
+    if trust_store is not None:
+        record["signature"] = trust_store.signature_status(parsed)
+    return record
+
+class DecodingServer:
+    def __init__(self, trust_store=None, workers=None, processes=False, max_pending=256, pipeline=32,
+                 timeout=5.0, fast=False, cache=None):
+        workers = workers or os.cpu_count() or 1
+        self.cache = cache
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(trust_store, cache))
+            self._decode = _decode_in_worker
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+            self._decode = partial(decode, trust_store=trust_store, cache=cache)
+        self.max_pending = max_pending
+        self.pipeline = pipeline
+        self.timeout = timeout
+        self.fast = fast
+        self._pending = None
+
+    async def _respond(self, barcode):
+        # The permit is released when the job ends, not when the response is sent:
+        # executor jobs cannot be interrupted, so a timed out job still counts
+        job = asyncio.get_running_loop().run_in_executor(self.executor, self._decode, barcode, self.fast)
+        job.add_done_callback(lambda _: self._pending.release())
+        try:
+            return await asyncio.wait_for(asyncio.shield(job), self.timeout)
+        except asyncio.TimeoutError:
+            return dict(error="Timeout", message=f"Decoding took more than {self.timeout} seconds")
+
+    async def _write_responses(self, queue, writer):
+        while (task := await queue.get()) is not None:
+            writer.write(json.dumps(await task).encode() + b"\n")
+            await writer.drain()
+
+    @staticmethod
+    async def _put(queue, item, sender):
+        """ Queues `item` unless the sender stops first (connection lost), returns whether it was queued. """
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait([put, sender], return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            return False
+        return True
+
+    async def handle(self, reader, writer):
+        # Responses are queued in request order; the bounded queue limits pipelining
+        queue = asyncio.Queue(self.pipeline)
+        sender = asyncio.create_task(self._write_responses(queue, writer))
+        try:
+            while not sender.done():
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    line = e.partial
+                except asyncio.LimitOverrunError:
+                    error = dict(error="LineTooLong", message=f"Lines are limited to {MAX_LINE} bytes")
+                    await self._put(queue, asyncio.sleep(0, error), sender)
+                    break
+                if not line:
+                    break
+                barcode = line.strip()
+                if barcode:
+                    await self._pending.acquire()
+                    if not await self._put(queue, asyncio.create_task(self._respond(barcode)), sender):
+                        break
+                if not line.endswith(b"\n"):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            await self._put(queue, None, sender)
+            try:
+                await sender
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, host="127.0.0.1", port=8765, ready=None):
+        self._pending = asyncio.Semaphore(self.max_pending)
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="idb1-server", description="Barcode decoding service (one barcode per line in, one JSON line out).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--public", type=argparse.FileType("rb"), help="trusted signer certificate (DER)")
+    parser.add_argument("--trust-dir", help="directory of trusted signer certificates (*.der)")
+    parser.add_argument("--workers", type=int, help="decoding threads or processes (default: number of CPUs)")
+    parser.add_argument("--processes", action="store_true", help="decode on worker processes instead of threads")
+    parser.add_argument("--max-pending", type=int, default=256, help="requests in flight over all connections (default: 256)")
+    parser.add_argument("--pipeline", type=int, default=32, help="requests in flight per connection (default: 32)")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds before a request is answered with a timeout (default: 5)")
+    parser.add_argument("--fast", action="store_true", help="decode with the fast path (see idb1.projection)")
+    parser.add_argument("--cache-size", type=int, default=0, help="responses cached per worker (default: 0, no cache)")
+    parser.add_argument("--cache-ttl", type=float, default=60.0, help="seconds a cached response is reused (default: 60)")
+    args = parser.parse_args(argv)
+
+    trust_store = None
+    if args.public or args.trust_dir:
+        from idb1.trust import TrustStore
+        try:
+            trust_store = TrustStore.from_directory(args.trust_dir) if args.trust_dir else TrustStore()
+            if args.public:
+                trust_store.add(args.public.read())
+        except Exception as e:
+            parser.error(str(e))
+
+    cache = ParseCache(max_entries=args.cache_size, ttl=args.cache_ttl) if args.cache_size > 0 else None
+    server = DecodingServer(trust_store, workers=args.workers, processes=args.processes, max_pending=args.max_pending,
+                            pipeline=args.pipeline, timeout=args.timeout, fast=args.fast, cache=cache)
+
+    def ready(s):
+        addresses = ", ".join(f"{a[0]}:{a[1]}" for a in (sock.getsockname() for sock in s.sockets))
+        print(f"idb1-server: listening on {addresses}", file=sys.stderr, flush=True)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if cache is not None and not args.processes:
+            print(f"idb1-server: cache {cache.stats()}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
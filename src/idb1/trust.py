@@ -0,0 +1,148 @@
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+from idb1.crypto import load_public_key
+from idb1.parser import verify
+
+def certificate_reference(raw_cert):
+    """ The 5 bytes reference stored in the header of signed barcodes. """
+    return sha1(raw_cert).digest()[-5:]
+
+class TrustStore:
+    """
+        Signer certificates (DER) indexed by their certificate reference. Parsed
+        verifying keys are kept in a bounded LRU cache, with precomputation applied,
+        so that verifying barcodes from many signers does not parse a key per scan.
+        References are only 5 bytes of a hash: certificates sharing one are all kept
+        and a barcode is valid if its signature verifies with any of them.
+        Only the certificates are pickled, so a store can be handed to worker processes.
+        Keys are loaded with the named ECDSA backend (see idb1.crypto).
+    """
+    def __init__(self, certificates=(), cache_size=128, backend=None):
+        self.cache_size = cache_size
+        self.backend = backend
+        # reference: list of certificates, in the order they were added
+        self._certificates = dict()
+        # reference: tuple of keys, one per certificate
+        self._keys = OrderedDict()
+        self._lock = Lock()
+        for raw_cert in certificates:
+            self.add(raw_cert)
+
+    @classmethod
+    def from_directory(cls, path, cache_size=128, backend=None):
+        """ Loads every *.der file in `path`. """
+        store = cls(cache_size=cache_size, backend=backend)
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(".der"):
+                with open(os.path.join(path, name), "rb") as f:
+                    try:
+                        store.add(f.read())
+                    except Exception as e:
+                        raise Exception(f"Invalid signer certificate {name}") from e
+        return store
+
+    def add(self, raw_cert):
+        """ Adds a signer certificate, returns its certificate reference. """
+        raw_cert = bytes(raw_cert)
+        try:
+            vk = load_public_key(raw_cert, self.backend, precompute=True)
+        except Exception as e:
+            raise Exception("Invalid ECDSA public certificate (DER format expected)") from e
+        reference = certificate_reference(raw_cert)
+        with self._lock:
+            certificates = self._certificates.setdefault(reference, [])
+            if raw_cert in certificates:
+                return reference
+            certificates.append(raw_cert)
+            keys = self._keys.get(reference, ())
+        if len(keys) == len(certificates) - 1:
+            self._cache(reference, keys + (vk,))
+        return reference
+
+    def _cache(self, reference, keys):
+        with self._lock:
+            self._keys[reference] = keys
+            self._keys.move_to_end(reference)
+            while len(self._keys) > self.cache_size:
+                self._keys.popitem(last=False)
+        return keys
+
+    def __len__(self):
+        return sum(len(certificates) for certificates in self._certificates.values())
+
+    def __contains__(self, reference):
+        return reference in self._certificates
+
+    def certificate(self, reference):
+        """ Returns the certificate for a reference (the first one added if several share it), or None. """
+        certificates = self._certificates.get(reference)
+        return certificates[0] if certificates else None
+
+    def certificates(self, reference):
+        """ Returns every certificate sharing a reference. """
+        return list(self._certificates.get(reference, ()))
+
+    def verifying_keys(self, reference):
+        """ Returns the keys (idb1.crypto.PublicKey) of every certificate sharing a reference. """
+        with self._lock:
+            keys = self._keys.get(reference)
+            if keys is not None:
+                self._keys.move_to_end(reference)
+                return keys
+            certificates = list(self._certificates.get(reference, ()))
+        if not certificates:
+            return ()
+        return self._cache(reference, tuple(load_public_key(raw_cert, self.backend, precompute=True)
+                                            for raw_cert in certificates))
+
+    def verifying_key(self, reference):
+        """
+            Returns the key (an idb1.crypto.PublicKey) for a certificate reference, or
+            None if unknown. See verifying_keys() for references shared by several
+            certificates.
+        """
+        keys = self.verifying_keys(reference)
+        return keys[0] if keys else None
+
+    def keys_for(self, parsed):
+        """ Returns the keys matching a barcode returned by parse(), possibly none. """
+        reference = parsed["content"]["signable"]["header"].get("certificate_reference")
+        return self.verifying_keys(reference) if reference is not None else ()
+
+    def key_for(self, parsed):
+        """ Returns the key matching a barcode returned by parse(), or None. """
+        keys = self.keys_for(parsed)
+        return keys[0] if keys else None
+
+    def verify(self, parsed):
+        """
+            Verifies a barcode returned by parse() with the certificates matching its
+            certificate reference. Raises if the barcode is not signed or its signer
+            is unknown.
+        """
+        if "signature_data" not in parsed["content"]:
+            raise Exception("The barcode is not signed")
+        keys = self.keys_for(parsed)
+        if not keys:
+            raise Exception("Unknown signer certificate reference")
+        return any(verify(parsed, vk) for vk in keys)
+
+    def signature_status(self, parsed):
+        """ "valid", "invalid", "unsigned" or "unknown signer", without raising. """
+        if "signature_data" not in parsed["content"]:
+            return "unsigned"
+        if self.key_for(parsed) is None:
+            return "unknown signer"
+        return "valid" if self.verify(parsed) else "invalid"
+
+    def __getstate__(self):
+        return dict(cache_size=self.cache_size, certificates=self._certificates, backend=self.backend)
+
+    def __setstate__(self, state):
+        self.cache_size = state["cache_size"]
+        self.backend = state.get("backend")
+        self._certificates = state["certificates"]
+        self._keys = OrderedDict()
+        self._lock = Lock()